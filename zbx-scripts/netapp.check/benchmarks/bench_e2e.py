@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark against local stand-ins (benchmarks/stubs.py).
+
+    ./benchmarks/bench_e2e.py --sizes 1000,10000,100000 --latency 0.005
+
+Scenarios:
+  sync          ServiceNow -> Zabbix pipeline (sn_toolkit, sort_info, zbx_toolkit)
+  sync-sharded  the same pipeline split over --shards concurrent workers (sync_toolkit)
+  ocum-lld      netapp_ocum_query.py --query volume --discovery
+  ocum-batch    netapp_ocum_query.py --query aggregate,svm,volume
+
+Each scenario runs in its own process(es); wall time includes interpreter
+startup, peak RSS is the largest child maxrss, API calls are counted by the stubs.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.append(os.path.join(ROOT, 'lib'))
+sys.path.append(HERE)
+
+import stubs
+
+
+SCENARIOS = ['sync', 'sync-sharded', 'ocum-lld', 'ocum-batch']
+
+
+def run_sync(zabbix, servicenow, workers, state_dir, shards=None):
+    """The sync pipeline as a driver script would run it; with shards, one worker of a sharded sync"""
+    import debug_toolkit
+    import sn_toolkit
+    import sort_info
+    import sync_toolkit
+    import zbx_toolkit
+    import refdata_toolkit
+
+    shard = None
+    if shards:
+        shard = debug_toolkit.take_lease('bench_sync', shards, lock_dir=state_dir)
+        if shard is None:
+            return {'shard': None}
+
+    refdata = refdata_toolkit.RefDataCache(os.path.join(state_dir, 'refdata'))
+    cis = list(sn_toolkit.iter_table_records(servicenow, 'bench', 'bench', 'cmdb_ci_server',
+                                             query='sysparm_display_value=all', fields=sort_info.CI_FIELDS))
+    templates_index = refdata_toolkit.sn_index(refdata, 'sn_templates', servicenow, 'bench', 'bench', 'zabbix_templates')
+    proxies_index = refdata_toolkit.sn_index(refdata, 'sn_proxies', servicenow, 'bench', 'bench', 'zabbix_proxies')
+    locations_index = refdata_toolkit.sn_index(refdata, 'sn_locations', servicenow, 'bench', 'bench', 'cmn_location')
+
+    if shards:
+        cis = sync_toolkit.shard_records(cis, shard, shards)
+    cis = sort_info.sort_sn_hosts_with_templates(cis)
+    sort_info.split_sn_templates_data(cis)
+    sort_info.correct_names(cis)
+
+    token = zbx_toolkit.get_cached_token(zabbix, 'bench', 'bench', cache_file=os.path.join(state_dir, 'token.json'))
+    if shards:
+        groups = sync_toolkit.ensure_groups(cis, token, zabbix, lock_file=os.path.join(state_dir, 'groups.lock'))
+    else:
+        groups = refdata_toolkit.zbx_hostgroups(refdata, token, zabbix)
+        new_groups = sort_info.compare_and_find_new_groups(cis, groups)
+        if new_groups:
+            zbx_toolkit.create_hostgroups(new_groups, token, zabbix)
+            refdata.invalidate('zbx_hostgroups', zabbix)
+            groups = refdata_toolkit.zbx_hostgroups(refdata, token, zabbix)
+
+    sn_groups = [group for group in groups if group['name'].startswith('ServiceNow/CMDB/')]
+    export_group = [group['groupid'] for group in groups if group['name'] == 'ServiceNow/Export'][0]
+    index = sort_info.index_zbx_hosts(zbx_toolkit.iter_hosts(token, zabbix, [group['groupid'] for group in sn_groups]))
+    if shards:
+        index = sync_toolkit.shard_hosts_index(index, shard, shards)
+    new, changed, unchanged = sort_info.reconcile(cis, index, sn_groups, export_group, templates_index, locations_index)
+
+    sort_info.sort_zbx_hosts_for_creating(new, templates_index, proxies_index, locations_index)
+    groupids = {group['name'].replace('ServiceNow/CMDB/', ''): group['groupid'] for group in sn_groups}
+    zbx_toolkit.create_hosts(token, zabbix, new, groupids, export_group)
+    summary = zbx_toolkit.apply_host_updates(token, zbx_toolkit.api_url(zabbix), changed, workers=workers)
+    return {'shard': shard, 'cis': len(cis), 'new': len(new), 'changed': len(changed), 'unchanged': len(unchanged),
+            'update_failures': len(summary['failed'])}
+
+
+def child(args):
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            result = run_sync(args.zabbix, args.servicenow, args.workers, args.state_dir, args.shards if args.child_shard else None)
+        finally:
+            sys.stdout = stdout
+    with open(args.result, 'w') as fh:
+        json.dump(result, fh)
+
+
+def measure_processes(commands):
+    """Run commands concurrently, return (wall seconds, largest peak RSS MB, worst exit code)"""
+    t = perf_counter()
+    procs = [subprocess.Popen(command, stdout=subprocess.DEVNULL) for command in commands]
+    rss, code = 0, 0
+    for proc in procs:
+        _, status, rusage = os.wait4(proc.pid, 0)
+        rss = max(rss, rusage.ru_maxrss / 1024.0)
+        code = max(code, os.waitstatus_to_exitcode(status))
+    return perf_counter() - t, rss, code
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated object counts (CIs / volumes)")
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected per-request latency, seconds")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=8, help="apply_host_updates workers")
+    parser.add_argument("--shards", type=int, default=4, help="Workers of the sync-sharded scenario")
+    parser.add_argument("--json", action="store_true", help="Print results as json")
+    # child mode
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--zabbix", help=argparse.SUPPRESS)
+    parser.add_argument("--servicenow", help=argparse.SUPPRESS)
+    parser.add_argument("--state-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--child-shard", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    zabbix, servicenow, ocum = stubs.ZabbixStub(args.latency), stubs.ServiceNowStub(args.latency), stubs.OCUMStub(args.latency)
+    _, zabbix_url = stubs.serve(zabbix, stubs.ZabbixHandler)
+    _, servicenow_url = stubs.serve(servicenow, stubs.ServiceNowHandler)
+    _, ocum_url = stubs.serve(ocum, stubs.OCUMHandler)
+    scenarios = args.scenarios.split(',')
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for scenario in scenarios:
+            state_dir = tempfile.mkdtemp(prefix='zbx_bench_')
+            result_files = []
+            if scenario.startswith('sync'):
+                tables, hosts, groups, templates, proxies = stubs.synthetic_sync(size)
+                servicenow.load(tables)
+                zabbix.load(hosts, groups, templates, proxies)
+                commands = []
+                for worker in range(args.shards if scenario == 'sync-sharded' else 1):
+                    result_files.append(os.path.join(state_dir, 'result{}.json'.format(worker)))
+                    commands.append([sys.executable, os.path.abspath(__file__), '--child', '--zabbix', zabbix_url, '--servicenow', servicenow_url,
+                                     '--state-dir', state_dir, '--result', result_files[-1], '--workers', str(args.workers), '--shards', str(args.shards)])
+                    if scenario == 'sync-sharded':
+                        commands[-1].append('--child-shard')
+            else:
+                ocum.load(stubs.synthetic_ocum(size))
+                command = [sys.executable, os.path.join(ROOT, 'netapp_ocum_query.py'), '--ocum-addr', ocum_url,
+                           '--ocum-user', 'bench', '--ocum-pass', 'bench']
+                command += ['--query', 'volume', '--discovery'] if scenario == 'ocum-lld' else ['--query', 'aggregate,svm,volume']
+                commands = [command]
+
+            for stub in (zabbix, servicenow, ocum):
+                stub.reset_calls()
+            wall, rss, code = measure_processes(commands)
+
+            result = {'scenario': scenario, 'size': size, 'wall': round(wall, 3), 'rss_mb': round(rss, 1), 'exit': code,
+                      'http_calls': zabbix.calls['http'] + servicenow.calls['http'] + ocum.calls['http'],
+                      'zabbix_rpc_calls': zabbix.calls['rpc']}
+            for result_file in result_files:
+                if os.path.exists(result_file):
+                    with open(result_file) as fh:
+                        for key, value in json.load(fh).items():
+                            if key != 'shard':
+                                result[key] = result.get(key, 0) + value
+            results.append(result)
+            if not args.json:
+                print("{scenario:>10} {size:>8} objects  {wall:>8.2f} s  {rss_mb:>7.1f} MB  {http_calls:>6} http  "
+                      "{zabbix_rpc_calls:>6} rpc  exit {exit}".format(**result))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Reconciliation benchmark: ServiceNow CIs vs Zabbix hosts on synthetic data.
+
+    ./benchmarks/bench_reconcile.py --sizes 10000,100000,500000
+
+The former list-based matching is timed too, up to --legacy-max CIs
+(it is O(n*m) and effectively never finishes at the larger sizes).
+"""
+
+import sys
+import os
+import argparse
+import random
+from time import perf_counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import sort_info
+
+
+CLASSES     = ['Linux Server', 'Windows Server', 'Network Gear', 'Storage Device', 'ESX Server']
+TEMPLATES   = 50
+LOCATIONS   = 200
+
+
+def synthetic(size, existing=0.9, changed=0.1, seed=1):
+    """size CIs; `existing` of them already in Zabbix, `changed` of those out of sync"""
+    rnd = random.Random(seed)
+    templates_index = {'tpl%d' % i: {'templateid': str(10000 + i)} for i in range(TEMPLATES)}
+    locations_index = {'loc%d' % i: {'latitude': rnd.uniform(-90, 90), 'longitude': rnd.uniform(-180, 180)} for i in range(LOCATIONS)}
+    groups = [{'groupid': str(100 + i), 'name': 'ServiceNow/CMDB/' + name} for i, name in enumerate(CLASSES)]
+    groups += [{'groupid': str(1000 + i), 'name': 'Other/%d' % i} for i in range(500)]
+    groupids = {group['name']: group['groupid'] for group in groups}
+
+    cis, hosts = [], []
+    for i in range(size):
+        sys_id = '%032x' % rnd.getrandbits(128)
+        name = 'ci-%d' % i
+        sys_class = rnd.choice(CLASSES)
+        location = 'loc%d' % rnd.randrange(LOCATIONS)
+        tpls = rnd.sample(sorted(templates_index), 2)
+        ip = '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+        cis.append({
+            'sys_id':                               {'value': sys_id},
+            'name':                                 {'value': name},
+            'sys_class_name':                       {'display_value': sys_class},
+            'x_itgra_monitoring_zabbix_template':   {'value': tpls},
+            'ip_address':                           {'value': ip},
+            'fqdn':                                 {'value': name + '.example.net'},
+            'location':                             {'value': location, 'display_value': location},
+        })
+        if rnd.random() >= existing:
+            continue
+
+        drift = rnd.random() < changed
+        hosts.append({
+            'hostid':           str(20000 + i),
+            'name':             name + ('-old' if drift else ''),
+            'host':             name + '_' + sys_id,
+            'inventory':        {'alias': sys_id, 'location': location},
+            'groups':           [{'groupid': groupids['ServiceNow/CMDB/' + sys_class], 'name': 'ServiceNow/CMDB/' + sys_class}],
+            'parentTemplates':  [{'templateid': templates_index[tpl]['templateid']} for tpl in tpls],
+            'interfaces':       [{'ip': ip, 'interfaceid': str(30000 + i), 'dns': name + '.example.net',
+                                  'type': '1' if sys_class in ('Linux Server', 'Windows Server') else '2'}],
+        })
+    return cis, hosts, groups, templates_index, locations_index
+
+
+def legacy_compare_and_find_new_hosts(zbx_hosts, sn_cis):
+    # former sort_info implementation: list membership, O(n*m)
+    zabbix_uids = [host['inventory']['alias'] for host in zbx_hosts if host['inventory']]
+    new = [item for item in sn_cis if item['sys_id']["value"] not in zabbix_uids]
+    old = [item for item in sn_cis if item['sys_id']["value"] in zabbix_uids]
+    return new, old
+
+
+def timed(func, *args):
+    t = perf_counter()
+    result = func(*args)
+    return result, perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,500000", help="Comma separated CI counts")
+    parser.add_argument("--legacy-max", type=int, default=20000, help="Largest size the former matching is timed at")
+    args = parser.parse_args()
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>12}".format('CIs', 'new', 'changed', 'unchanged', 'engine, s', 'legacy, s'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        cis, hosts, groups, templates_index, locations_index = synthetic(size)
+
+        def engine():
+            hosts_index = sort_info.index_zbx_hosts(hosts)
+            return sort_info.reconcile(cis, hosts_index, groups, '1', templates_index, locations_index)
+
+        (new, changed, unchanged), engine_time = timed(engine)
+
+        legacy = 'skipped'
+        if size <= args.legacy_max:
+            legacy = '{:.2f}'.format(timed(legacy_compare_and_find_new_hosts, hosts, cis)[1])
+
+        print("{:>8} {:>10} {:>10} {:>10} {:>10.2f} {:>12}".format(size, len(new), len(changed), len(unchanged), engine_time, legacy))
+
+
+if __name__ == "__main__":
+    main()
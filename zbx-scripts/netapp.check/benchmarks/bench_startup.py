@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Startup-time benchmark of netapp_ocum_query.py, checked against a budget.
+
+    ./benchmarks/bench_startup.py                   # compare with startup_budget.json
+    ./benchmarks/bench_startup.py --write-budget    # record the current figures (new release)
+
+Scenarios (each a fresh interpreter, median of --runs):
+  import        import netapp_ocum_query and the toolkits it loads up front
+  help          netapp_ocum_query.py --help
+  cached-query  --query volume --discovery served from a warm --cache-ttl cache
+
+Times are in milliseconds above a bare `python -c pass`. The budget is
+kept as a ratio to a reference import (REFERENCE: requests, json,
+argparse) measured in the same run, so a slower or busier
+machine moves both sides alike. -X importtime of the cached query shows
+where the time goes. Exits 1 when a scenario is over budget.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+from statistics import median
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.append(os.path.join(ROOT, 'lib'))
+sys.path.append(HERE)
+
+import stubs
+
+
+BUDGET_FILE = os.path.join(HERE, 'startup_budget.json')
+HEADROOM = 2.0          # budget = measured / reference * HEADROOM when written
+REFERENCE = 'import json, argparse, requests'
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def wall(commands, runs):
+    """Median wall time of each command, milliseconds.
+
+    The commands take turns, run after run, so a load change on the
+    machine hits all of them instead of the one that happened to be running.
+    """
+    times = {name: [] for name in commands}
+    for _ in range(runs):
+        for name, command in commands.items():
+            t = perf_counter()
+            subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times[name].append((perf_counter() - t) * 1000)
+    return {name: median(values) for name, values in times.items()}
+
+
+def top_imports(command, count):
+    """Imports made by the script itself, by cumulative import time (-X importtime), milliseconds"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    imports = []
+    for match in IMPORTTIME_RE.finditer(stderr):
+        _, cumulative, indent, module = match.groups()
+        # site and its .pth hooks run before the script, same as for `python -c pass`
+        if len(indent) == 1 and module != 'site':
+            imports.append((int(cumulative) / 1000.0, module))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20, help="Runs per scenario")
+    parser.add_argument("--top", type=int, default=10, help="Imports shown from -X importtime")
+    parser.add_argument("--write-budget", action="store_true", help="Write the current figures to " + os.path.basename(BUDGET_FILE))
+    args = parser.parse_args()
+
+    ocum = stubs.OCUMStub()
+    ocum.load(stubs.synthetic_ocum(1000))
+    _, ocum_url = stubs.serve(ocum, stubs.OCUMHandler)
+    script = os.path.join(ROOT, 'netapp_ocum_query.py')
+    cache_dir = tempfile.mkdtemp(prefix='zbx_bench_')
+    cached_query = [sys.executable, script, '--ocum-addr', ocum_url, '--ocum-user', 'bench', '--ocum-pass', 'bench',
+                    '--query', 'volume', '--discovery', '--cache-ttl', '3600', '--cache-dir', cache_dir]
+    subprocess.run(cached_query, stdout=subprocess.DEVNULL, check=True)
+
+    scenarios = {
+        'import':       [sys.executable, '-c', 'import sys; sys.path.insert(0, "."); import netapp_ocum_query'],
+        'help':         [sys.executable, script, '--help'],
+        'cached-query': cached_query,
+    }
+    times = wall(dict(scenarios, baseline=[sys.executable, '-c', 'pass'], reference=[sys.executable, '-c', REFERENCE]), args.runs)
+    baseline = times.pop('baseline')
+    reference = times.pop('reference') - baseline
+    results = {name: round(ms - baseline, 1) for name, ms in times.items()}
+
+    budget = {}
+    if os.path.exists(BUDGET_FILE):
+        with open(BUDGET_FILE) as fh:
+            budget = json.load(fh)
+    over = []
+    print("interpreter startup {:8.1f} ms".format(baseline))
+    print("          reference {:8.1f} ms   ({})".format(reference, REFERENCE))
+    for name, ms in results.items():
+        ratio = ms / reference
+        limit = budget.get(name)
+        status = '' if limit is None else ('ok' if ratio <= limit else 'OVER')
+        if status == 'OVER':
+            over.append(name)
+        print("{:>19} {:8.1f} ms   x{:.2f} reference   budget {:>6}  {}".format(
+            name, ms, ratio, '-' if limit is None else 'x{:.2f}'.format(limit), status))
+
+    print("\nslowest imports (cached-query):")
+    for ms, module in top_imports(scenarios['cached-query'], args.top):
+        print("{:>19} {:8.1f} ms".format(module, ms))
+
+    if args.write_budget:
+        with open(BUDGET_FILE, 'w') as fh:
+            json.dump({name: round(ms / reference * HEADROOM, 2) for name, ms in results.items()}, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print("\nbudget written to {}".format(BUDGET_FILE))
+    elif over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
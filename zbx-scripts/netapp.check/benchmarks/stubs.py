@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the Zabbix JSON-RPC API, the ServiceNow Table API and
+the OCUM REST inventory, serving synthetic data with injected latency.
+
+Only what the toolkits use is implemented; every request is counted.
+"""
+
+import json
+import random
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import sleep
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+
+CLASSES         = ['Linux Server', 'Windows Server', 'Network Gear', 'Storage Device']
+TEMPLATES       = 20
+PROXIES         = 4
+LOCATIONS       = 50
+OCUM_PAGE_SIZE  = 1000
+
+
+class Stub(object):
+    """Shared state of one stand-in: latency, request counters, data"""
+    def __init__(self, latency=0.0):
+        super(Stub, self).__init__()
+        self.latency    = latency
+        self.lock       = threading.Lock()
+        self.calls      = Counter()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.calls[name] += n
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+    def handle_one(self, method):
+        self.stub.count('http')
+        if self.stub.latency:
+            sleep(self.stub.latency)
+        getattr(self, 'serve_' + method)()
+
+    def do_GET(self):
+        self.handle_one('get')
+
+    def do_POST(self):
+        self.handle_one('post')
+
+    def do_PUT(self):
+        self.handle_one('put')
+
+    def do_DELETE(self):
+        self.handle_one('delete')
+
+
+# --- Zabbix ---------------------------------------------------------------
+
+class ZabbixStub(Stub):
+    def __init__(self, latency=0.0):
+        super(ZabbixStub, self).__init__(latency)
+        self.hosts      = {}
+        self.groups     = {}
+        self.templates  = []
+        self.proxies    = []
+        self.next_id    = 100000
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return str(self.next_id)
+
+    def load(self, hosts, groups, templates, proxies):
+        self.hosts      = {host['hostid']: host for host in hosts}
+        self.groups     = {group['groupid']: group for group in groups}
+        self.templates  = templates
+        self.proxies    = proxies
+
+    def call(self, method, params):
+        self.stub_count(method)
+        handler = getattr(self, 'api_' + method.replace('.', '_'), None)
+        if handler is None:
+            return None, {'code': -32601, 'message': 'Method not found.', 'data': method}
+        try:
+            return handler(params or {}), None
+        except (KeyError, ValueError) as e:
+            return None, {'code': -32602, 'message': 'Invalid params.', 'data': str(e)}
+
+    def stub_count(self, method):
+        self.count('rpc')
+        self.count(method)
+
+    def api_user_login(self, params):
+        return 'benchtoken'
+
+    def api_user_checkAuthentication(self, params):
+        return {'sessionid': params.get('sessionid')}
+
+    def api_hostgroup_get(self, params):
+        if params.get('countOutput'):
+            return str(len(self.groups))
+        return list(self.groups.values())
+
+    def api_hostgroup_create(self, params):
+        groupid = self.new_id()
+        self.groups[groupid] = {'groupid': groupid, 'name': params['name']}
+        return {'groupids': [groupid]}
+
+    def api_template_get(self, params):
+        if params.get('countOutput'):
+            return str(len(self.templates))
+        return self.templates
+
+    def api_proxy_get(self, params):
+        if params.get('countOutput'):
+            return str(len(self.proxies))
+        return self.proxies
+
+    def api_host_get(self, params):
+        hosts = self.hosts.values()
+        if params.get('groupids'):
+            groupids = set(map(str, as_list(params['groupids'])))
+            hosts = [host for host in hosts if groupids & set(group['groupid'] for group in host['groups'])]
+        if params.get('hostids'):
+            hosts = [self.hosts[hostid] for hostid in map(str, as_list(params['hostids'])) if hostid in self.hosts]
+        hosts = list(hosts)
+        if params.get('countOutput'):
+            return str(len(hosts))
+        if params.get('sortfield') == 'hostid':
+            hosts.sort(key=lambda host: int(host['hostid']))
+        if params.get('limit'):
+            hosts = hosts[:int(params['limit'])]
+        if params.get('output') in (['hostid'], 'hostid'):
+            return [{'hostid': host['hostid']} for host in hosts]
+        return hosts
+
+    def api_host_create(self, params):
+        hostid = self.new_id()
+        group_names = {groupid: group['name'] for groupid, group in self.groups.items()}
+        interfaces = [dict(interface, interfaceid=self.new_id(), type=str(interface['type'])) for interface in params.get('interfaces', [])]
+        self.hosts[hostid] = {
+            'hostid':           hostid,
+            'name':             params['name'],
+            'host':             params['host'],
+            'inventory':        dict(params.get('inventory', {}), location=''),
+            'groups':           [{'groupid': str(group['groupid']), 'name': group_names.get(str(group['groupid']), '')} for group in params['groups']],
+            'parentTemplates':  [{'templateid': str(template['templateid'])} for template in params.get('templates', [])],
+            'interfaces':       interfaces,
+        }
+        return {'hostids': [hostid]}
+
+    def api_host_update(self, params):
+        host = self.hosts[str(params['hostid'])]
+        for field in ('name', 'host'):
+            if field in params: host[field] = params[field]
+        if 'templates' in params:
+            host['parentTemplates'] = [{'templateid': str(t['templateid'] if isinstance(t, dict) else t)} for t in params['templates']]
+        if 'groups' in params:
+            host['groups'] = [{'groupid': str(group['groupid']), 'name': self.groups.get(str(group['groupid']), {}).get('name', '')} for group in params['groups']]
+        if 'inventory' in params:
+            host['inventory'].update(params['inventory'])
+        return {'hostids': [host['hostid']]}
+
+    def api_hostinterface_update(self, params):
+        for host in self.hosts.values():
+            for interface in host['interfaces']:
+                if interface['interfaceid'] == str(params['interfaceid']):
+                    for field in ('ip', 'dns', 'type'):
+                        if field in params: interface[field] = str(params[field])
+                    return {'interfaceids': [interface['interfaceid']]}
+        raise KeyError(params['interfaceid'])
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+class ZabbixHandler(Handler):
+    def serve_post(self):
+        request = self.body()
+        batch = isinstance(request, list)
+        replies = []
+        for call in (request if batch else [request]):
+            result, error = self.stub.call(call['method'], call.get('params'))
+            reply = {'jsonrpc': '2.0', 'id': call.get('id')}
+            if error: reply['error'] = error
+            else: reply['result'] = result
+            replies.append(reply)
+        self.reply(200, replies if batch else replies[0])
+
+
+# --- ServiceNow -----------------------------------------------------------
+
+class ServiceNowStub(Stub):
+    def __init__(self, latency=0.0):
+        super(ServiceNowStub, self).__init__(latency)
+        self.tables = {}
+
+    def load(self, tables):
+        self.tables = tables
+
+
+class ServiceNowHandler(Handler):
+    def serve_get(self):
+        parts = urlsplit(self.path)
+        table = parts.path.rsplit('/', 1)[-1]
+        query = parse_qs(parts.query)
+        records = self.stub.tables.get(table)
+        if records is None:
+            return self.reply(404, {'error': {'message': 'Invalid table ' + table}})
+        self.stub.count(table)
+
+        total = len(records)
+        offset = int(query.get('sysparm_offset', ['0'])[0])
+        limit = int(query.get('sysparm_limit', [str(total)])[0])
+        page = records[offset:offset + limit]
+        if 'sysparm_fields' in query:
+            fields = query['sysparm_fields'][0].split(',')
+            page = [{field: record[field] for field in fields if field in record} for record in page]
+        self.reply(200, {'result': page}, {'X-Total-Count': str(total)})
+
+
+# --- OCUM -----------------------------------------------------------------
+
+class OCUMStub(Stub):
+    def __init__(self, latency=0.0):
+        super(OCUMStub, self).__init__(latency)
+        self.inventory = {}
+
+    def load(self, inventory):
+        self.inventory = inventory
+
+
+class OCUMHandler(Handler):
+    def serve_get(self):
+        parts = urlsplit(self.path)
+        resource = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        item_type = resource[:-1]
+        records = self.stub.inventory.get(item_type)
+        if records is None:
+            return self.reply(404, {'error': 'unknown resource ' + resource})
+        self.stub.count(resource)
+
+        offset = int(parse_qs(parts.query).get('offset', ['0'])[0])
+        body = {'_embedded': {'netapp:{}InventoryList'.format(item_type): records[offset:offset + OCUM_PAGE_SIZE]},
+                '_links': {'self': {'href': self.path}}}
+        if offset + OCUM_PAGE_SIZE < len(records):
+            body['_links']['next'] = {'href': '{}?{}'.format(parts.path, urlencode({'offset': offset + OCUM_PAGE_SIZE}))}
+        self.reply(200, body)
+
+
+# --- servers and data -----------------------------------------------------
+
+def serve(stub, handler):
+    """Start stub on an ephemeral localhost port, return (server, base url)"""
+    handler_class = type(handler.__name__, (handler,), {'stub': stub})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def field(value, display_value=None):
+    return {'value': value, 'display_value': value if display_value is None else display_value}
+
+
+def synthetic_sync(size, existing=0.8, changed=0.1, seed=1):
+    """ServiceNow tables and the matching Zabbix state for `size` CIs"""
+    rnd = random.Random(seed)
+    templates = [{'host': 'Template %d' % i, 'templateid': str(10001 + i)} for i in range(TEMPLATES)]
+    proxies = [{'host': 'proxy%d' % i, 'proxyid': str(20001 + i)} for i in range(PROXIES)]
+    sn_templates = [{'sys_id': 'tpl%d' % i, 'templateid': template['templateid']} for i, template in enumerate(templates)]
+    sn_proxies = [{'sys_id': 'prx%d' % i, 'proxyid': proxy['proxyid']} for i, proxy in enumerate(proxies)]
+    sn_locations = [{'sys_id': 'loc%d' % i, 'name': 'Location %d' % i,
+                     'latitude': '%.4f' % rnd.uniform(-90, 90), 'longitude': '%.4f' % rnd.uniform(-180, 180)} for i in range(LOCATIONS)]
+
+    groups = [{'groupid': '1', 'name': 'ServiceNow/Export'}]
+    groups += [{'groupid': str(2 + i), 'name': 'ServiceNow/CMDB/' + name} for i, name in enumerate(CLASSES[:-1])]
+    groupids = {group['name']: group['groupid'] for group in groups}
+
+    cis, hosts = [], []
+    for i in range(size):
+        sys_id = '%032x' % rnd.getrandbits(128)
+        name = 'ci-%d' % i
+        sys_class = rnd.choice(CLASSES)
+        location = rnd.choice(sn_locations)
+        tpls = rnd.sample(sn_templates, 2)
+        ip = '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+        cis.append({
+            'sys_id':                               field(sys_id),
+            'name':                                 field(name),
+            'sys_class_name':                       field(sys_class.lower().replace(' ', '_'), sys_class),
+            'ip_address':                           field(ip),
+            'fqdn':                                 field(name + '.example.net'),
+            'location':                             field(location['sys_id'], location['name']),
+            'x_itgra_monitoring_zabbix_template':   field(','.join(tpl['sys_id'] for tpl in tpls)),
+            'x_itgra_monitoring_zabbix_proxy':      field(rnd.choice(sn_proxies)['sys_id']),
+            'sys_updated_on':                       field('2026-01-01 00:00:00'),
+        })
+        group_name = 'ServiceNow/CMDB/' + sys_class
+        if rnd.random() >= existing or group_name not in groupids:
+            continue
+
+        drift = rnd.random() < changed
+        hostid = str(30000 + i)
+        hosts.append({
+            'hostid':           hostid,
+            'name':             name + ('-old' if drift else ''),
+            'host':             name + '_' + sys_id,
+            'inventory':        {'alias': sys_id, 'location': location['name'],
+                                 'location_lat': location['latitude'], 'location_lon': location['longitude']},
+            'groups':           [{'groupid': '1', 'name': 'ServiceNow/Export'}, {'groupid': groupids[group_name], 'name': group_name}],
+            'parentTemplates':  [{'templateid': tpl['templateid']} for tpl in tpls],
+            'interfaces':       [{'interfaceid': str(40000 + i), 'ip': '192.0.2.1' if drift else ip, 'dns': name + '.example.net',
+                                  'type': '1' if sys_class in ('Linux Server', 'Windows Server') else '2'}],
+        })
+
+    tables = {'cmdb_ci_server': cis, 'zabbix_templates': sn_templates, 'zabbix_proxies': sn_proxies, 'cmn_location': sn_locations}
+    return tables, hosts, groups, templates, proxies
+
+
+def synthetic_ocum(size, clusters=4, seed=1):
+    """`size` volumes plus proportional aggregates and SVMs"""
+    rnd = random.Random(seed)
+    inventory = {}
+    for item_type, count in (('volume', size), ('aggregate', max(1, size // 50)), ('svm', max(1, size // 20))):
+        records = []
+        for i in range(count):
+            cluster = i % clusters
+            total = rnd.randrange(1, 1000) * 2 ** 30
+            used = rnd.randrange(0, total)
+            records.append({
+                item_type:      {'id': 1000000 + i, 'label': '{}_{}'.format(item_type, i), '_links': {'self': {'href': '/rest/{}s/{}'.format(item_type, i)}}},
+                'cluster':      {'id': 100 + cluster, 'label': 'cluster{}'.format(cluster), '_links': {}},
+                'node':         {'id': 200 + cluster * 2 + i % 2, 'label': 'node{}'.format(cluster * 2 + i % 2), '_links': {}},
+                'status':       rnd.choice(['normal', 'normal', 'normal', 'warning']),
+                'state':        'online',
+                'size_total':   total,
+                'size_used':    used,
+                'size_avail':   total - used,
+                'size_used_percent': round(100.0 * used / total, 2),
+                '_links':       {'self': {'href': '/rest/{}s/{}'.format(item_type, i)}},
+            })
+        inventory[item_type] = records
+    return inventory
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import stat
+import fcntl
+import tempfile
+import threading
+from time import time, sleep
+from datetime import datetime
+
+import debug_toolkit
+
+
+# one directory per user: a name in the shared temp dir other users can't squat
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'zbx_toolkit_cache_{}'.format(os.getuid()))
+TTL = 60
+IDLE = 3600
+
+
+def cache_key(*parts):
+    """Stable file name for any json-serializable key parts"""
+    import hashlib
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def private_dir(path):
+    """Create path (0700) and make sure it is ours and closed to everybody else; raises PermissionError"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError('{}: not a directory owned by uid {}'.format(path, os.getuid()))
+    # ours, but made by makedirs as a parent (umask mode): close it
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def read_json(path):
+    """json content of path, None when missing, invalid or not owned by us"""
+    try:
+        with open(path, 'r') as fh:
+            if os.fstat(fh.fileno()).st_uid != os.getuid():
+                return None
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data, mode=0o600):
+    """Atomic write: readers see either the old or the new file, never a partial one"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+class FileCache(object):
+    """TTL cache of json values on disk, shared between processes.
+
+    Only one process refreshes an expired entry (fcntl lock, as in
+    debug_toolkit.run_once); the others either get the stale copy or
+    wait for the refresh to finish.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, ttl=TTL, serve_stale=True):
+        super(FileCache, self).__init__()
+        self.cache_dir   = cache_dir
+        self.ttl         = ttl
+        self.serve_stale = serve_stale
+        private_dir(self.cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _fresh(self, entry, ttl):
+        return entry is not None and time() - entry['time'] < ttl
+
+    def get(self, key, refresh, ttl=None):
+        """Return the cached value for key, calling refresh() when it has expired"""
+        ttl = self.ttl if ttl is None else ttl
+        path = self._path(key)
+        entry = read_json(path)
+        if self._fresh(entry, ttl):
+            return entry['value']
+
+        with open(path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # somebody else is refreshing this entry
+                if entry is not None and self.serve_stale:
+                    if debug_toolkit.TRACE: print("[cache] stale hit {}".format(key))
+                    return entry['value']
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                entry = read_json(path)
+                if self._fresh(entry, ttl):
+                    return entry['value']
+
+                if debug_toolkit.TRACE: print("[cache] refresh {}".format(key))
+                value = refresh()
+                write_json(path, {'time': time(), 'value': value})
+                return value
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def invalidate(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class MemoryCache(object):
+    """In-process cache refreshed in the background, for long-running processes.
+
+    Same get(key, refresh) interface as FileCache. The first get() of a key
+    runs refresh() (concurrent callers of that key wait for it); after that
+    the value is always served from memory and a background thread re-runs
+    refresh every ttl seconds, one key at a time. Keys nobody asked for in
+    `idle` seconds are dropped; a failed refresh keeps the previous value.
+    """
+    def __init__(self, ttl=TTL, idle=IDLE):
+        super(MemoryCache, self).__init__()
+        self.ttl        = ttl
+        self.idle       = idle
+        self.entries    = {}
+        self.key_locks  = {}
+        self.lock       = threading.Lock()
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, refresh, ttl=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            with self._key_lock(key):
+                entry = self.entries.get(key)
+                if entry is None:
+                    if debug_toolkit.TRACE: print("[cache] load {}".format(key))
+                    entry = {'value': refresh(), 'refresh': refresh, 'ttl': self.ttl if ttl is None else ttl, 'time': time()}
+                    self.entries[key] = entry
+        entry['used'] = time()
+        return entry['value']
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def refresh_due(self):
+        """Refresh the expired entries, drop the idle ones"""
+        for key, entry in list(self.entries.items()):
+            if time() - entry.get('used', entry['time']) >= self.idle:
+                self.invalidate(key)
+                continue
+            if time() - entry['time'] < entry['ttl']:
+                continue
+            if debug_toolkit.TRACE: print("[cache] refresh {}".format(key))
+            try:
+                entry['value'] = entry['refresh']()
+            except Exception as e:
+                print("{} [cache] refresh of {} failed, keeping the previous value: {}".format(datetime.now(), key, e))
+            # a failed refresh waits for the next period too: no retry storm
+            entry['time'] = time()
+
+    def start(self, interval=1):
+        """Run refresh_due every interval seconds in a daemon thread"""
+        def loop():
+            while True:
+                sleep(interval)
+                self.refresh_due()
+        thread = threading.Thread(target=loop, name='cache-refresh', daemon=True)
+        thread.start()
+        return thread
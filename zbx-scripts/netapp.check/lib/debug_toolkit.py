@@ -4,7 +4,11 @@ import json
 from functools import wraps
 from time import time
 import os
+import sys
 import fcntl
+import tempfile
+import threading
+from bisect import bisect_left
 from datetime import datetime
 
 
@@ -14,6 +18,8 @@ DEBUG=False
 
 delays={}
 
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
 START_TIME = datetime.now()
 
 def first(iter):
@@ -54,16 +60,91 @@ def dry_request(url, headers, method=None, payload=None):
 def debugtest01():
     print("test ok")
 
+class Metrics(object):
+    """Per-name call counters, latency histograms and byte counts (thread safe)"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        super(Metrics, self).__init__()
+        self.buckets    = buckets
+        self.lock       = threading.Lock()
+        self.series     = {}
+
+    def observe(self, name, seconds, error=False, sent=0, received=0):
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max': 0.0,
+                                              'sent': 0, 'received': 0, 'buckets': [0] * (len(self.buckets) + 1)}
+            series['count'] += 1
+            series['errors'] += int(bool(error))
+            series['seconds'] += seconds
+            series['max'] = max(series['max'], seconds)
+            series['sent'] += sent
+            series['received'] += received
+            series['buckets'][bisect_left(self.buckets, seconds)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(series, buckets=list(series['buckets'])) for name, series in self.series.items()}
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+metrics = Metrics()
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(prefix='zbx_sync', registry=None):
+    """Registry contents in the Prometheus text exposition format"""
+    registry = registry or metrics
+    series = registry.snapshot()
+    lines = ['# TYPE {}_call_duration_seconds histogram'.format(prefix)]
+    for name, data in sorted(series.items()):
+        label = 'name="{}"'.format(prometheus_label(name))
+        cumulative = 0
+        for bound, count in zip(list(registry.buckets) + ['+Inf'], data['buckets']):
+            cumulative += count
+            lines.append('{}_call_duration_seconds_bucket{{{},le="{}"}} {}'.format(prefix, label, bound, cumulative))
+        lines.append('{}_call_duration_seconds_sum{{{}}} {}'.format(prefix, label, data['seconds']))
+        lines.append('{}_call_duration_seconds_count{{{}}} {}'.format(prefix, label, data['count']))
+    for metric, field in (('call_errors_total', 'errors'), ('request_bytes_total', 'sent'), ('response_bytes_total', 'received')):
+        lines.append('# TYPE {}_{} counter'.format(prefix, metric))
+        for name, data in sorted(series.items()):
+            lines.append('{}_{}{{name="{}"}} {}'.format(prefix, metric, prometheus_label(name), data[field]))
+    lines.append('# TYPE {}_run_duration_seconds gauge'.format(prefix))
+    lines.append('{}_run_duration_seconds {}'.format(prefix, get_uptime()))
+    lines.append('# TYPE {}_last_run_timestamp_seconds gauge'.format(prefix))
+    lines.append('{}_last_run_timestamp_seconds {}'.format(prefix, time()))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(path, prefix='zbx_sync', registry=None):
+    """Atomically (re)write a node_exporter textfile collector file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(prometheus_text(prefix, registry))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
 def measure(operation=sum):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             t = time()
-            result = func(*args, **kwargs)
-            ttr = time() - t
-            #delays.append( {'func':func.__name__, 'args': args, 'kwargs':kwargs, 'ttr':ttr})
-            key = func.__module__ + "." + func.__name__
-            delays[key] = operation((ttr, delays.get(key, 0)))
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+            finally:
+                ttr = time() - t
+                #delays.append( {'func':func.__name__, 'args': args, 'kwargs':kwargs, 'ttr':ttr})
+                key = func.__module__ + "." + func.__name__
+                delays[key] = operation((ttr, delays.get(key, 0)))
+                metrics.observe(key, ttr, error=error)
             if TRACE: print("[@measure({0})] {1} took: {2:.2f} s".format(operation.__name__,key,ttr))
             return result
         return wrapper
@@ -83,6 +164,31 @@ def run_once(main):
         #os._exit(0)
         return False
 
+leases = []
+def take_lease(name, partitions, lock_dir=None, start=0):
+    """run_once for one of `partitions` shards: lock the first free <name>.<n>.lock.
+
+    Returns the partition number, held until the process exits, or None when
+    every partition already has a worker. start spreads workers over the
+    partitions they try first. The locks default to the private per-user
+    cache directory, where no other user can create or hold them.
+    """
+    if lock_dir is None:
+        # cache_toolkit imports this module
+        import cache_toolkit
+        lock_dir = cache_toolkit.private_dir(cache_toolkit.CACHE_DIR)
+    for offset in range(partitions):
+        partition = (start + offset) % partitions
+        lease = open(os.path.join(lock_dir, '{}.{}.lock'.format(name, partition)), 'a')
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lease.close()
+            continue
+        leases.append(lease)
+        return partition
+    return None
+
 def get_uptime():
     return (datetime.now() - START_TIME).total_seconds()
 
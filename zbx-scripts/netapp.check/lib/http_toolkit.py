@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+from itertools import islice
+from time import sleep, time
+from urllib.parse import urlsplit
+
+import debug_toolkit
+
+
+TIMEOUT         = (5, 30)       # connect, read
+RETRIES         = 3
+BACKOFF         = 0.5           # seconds, doubled on every attempt
+RETRY_STATUS    = {429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+POOL_SIZE       = 16
+MAX_RETRY_AFTER = 60            # seconds, cap of a server's Retry-After
+
+# adaptive concurrency (AIMD) per endpoint, see Limiter
+ADAPTIVE            = True
+MIN_CONCURRENCY     = 1
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY     = POOL_SIZE
+DECREASE            = 0.5       # limit multiplier on throttling and errors
+LATENCY_DECREASE    = 0.9       # limit multiplier on congestion (slow answers)
+LATENCY_TOLERANCE   = 3.0       # slower than this times the baseline latency is congestion
+HEADERS         = {"Accept-Encoding": "gzip, deflate"}
+
+# the request may already have been processed: only retried for idempotent methods
+IDEMPOTENT      = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+# requests (with urllib3, charset detection, certifi) is most of the startup
+# time of a check: imported on the first request, not with the module
+requests = None
+
+sessions = {}
+sessions_lock = threading.Lock()
+limiters = {}
+
+
+def load_requests():
+    global requests
+    if requests is None:
+        import requests as module
+        from urllib3.exceptions import InsecureRequestWarning
+        module.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+        requests = module
+    return requests
+
+
+def __getattr__(name):
+    # http_toolkit.RequestException without importing requests up front
+    if name == 'RequestException':
+        return load_requests().exceptions.RequestException
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def endpoint(url):
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def get_session(url):
+    """Keep-alive session shared by every request to the same scheme://host:port"""
+    key = endpoint(url)
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            load_requests()
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.verify = False
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount(key, adapter)
+            sessions[key] = session
+    return session
+
+
+class Limiter(object):
+    """Adaptive limit of in-flight requests to one endpoint (AIMD).
+
+    Every successful answer adds 1/limit (about +1 per round of requests);
+    a 429/503, a 5xx or a connection error halves the limit and a latency
+    above LATENCY_TOLERANCE times the baseline of that call (metric) trims
+    it - once per round trip: answers to requests sent before the last
+    decrease don't count again. A Retry-After holds every request to the
+    endpoint until it has passed. Workers above the limit wait in acquire().
+    """
+    def __init__(self, name, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        super(Limiter, self).__init__()
+        self.name           = name
+        self.limit          = float(initial)
+        self.minimum        = minimum
+        self.maximum        = maximum
+        self.in_flight      = 0
+        self.baselines      = {}        # metric -> smoothed latency of the fastest answers
+        self.last_decrease  = 0
+        self.paused_until   = 0
+        self.condition      = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, started, metric=None, latency=None, throttled=False, failed=False, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            baseline = self.baselines.get(metric)
+            congested = latency is not None and baseline is not None and latency > baseline * LATENCY_TOLERANCE
+            if throttled or failed or congested:
+                if started > self.last_decrease:
+                    self.limit = max(self.minimum, self.limit * (DECREASE if throttled or failed else LATENCY_DECREASE))
+                    self.last_decrease = now
+                    if debug_toolkit.TRACE: print("[http] {} concurrency down to {:.1f}".format(self.name, self.limit))
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if latency is not None and not (throttled or failed):
+                # follows improvements at once, degradations slowly
+                self.baselines[metric] = latency if baseline is None else min(latency, baseline * 0.95 + latency * 0.05)
+            self.condition.notify_all()
+
+
+def get_limiter(url):
+    key = endpoint(url)
+    with sessions_lock:
+        limiter = limiters.get(key)
+        if limiter is None:
+            limiter = limiters[key] = Limiter(key)
+    return limiter
+
+
+def retry_after(response):
+    """Seconds asked by a Retry-After header (delta or HTTP date), None without one"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def retryable(method, status, wait=None):
+    """Whether an answer with this status may be sent again.
+
+    A 502/504 (or a bare 500/503) may come after the server applied the
+    request, so a POST is only repeated when the server said it did not
+    process it: 429, or 503 with a Retry-After.
+    """
+    if status not in RETRY_STATUS:
+        return False
+    if method in IDEMPOTENT:
+        return True
+    return status == 429 or (status == 503 and wait is not None)
+
+
+def unsent(error):
+    """True when a connection error left the request unsent: the connection itself was never made"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    from urllib3.exceptions import NewConnectionError
+    # requests wraps urllib3's MaxRetryError, whose reason is the original error
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def backoff(attempt):
+    # full jitter: spreads the retries of concurrent workers
+    return random.uniform(0, BACKOFF * 2 ** attempt)
+
+
+def body_size(data):
+    return len(data) if isinstance(data, (str, bytes)) else 0
+
+
+def map_ordered(function, items, workers):
+    """Yield function(item) for every item, in order, from `workers` threads.
+
+    Unlike Executor.map, items are consumed as results are taken: at most
+    workers * 2 calls are in flight or waiting, so memory stays flat however
+    many chunks or pages there are.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = deque(executor.submit(function, item) for item in islice(items, workers * 2))
+        while window:
+            result = window.popleft().result()
+            for item in islice(items, 1):
+                window.append(executor.submit(function, item))
+            yield result
+
+
+def request(method, url, retries=RETRIES, timeout=TIMEOUT, metric=None, **kwargs):
+    """requests.request on a pooled session, retrying 429/5xx (see retryable) and connection errors (see unsent)
+
+    Every attempt is recorded in debug_toolkit.metrics under metric
+    (default: '<METHOD> <host><path>') and, with ADAPTIVE, waits for a
+    slot of the endpoint's Limiter. A Retry-After is honoured.
+    """
+    method = method.upper()
+    session = get_session(url)
+    limiter = get_limiter(url) if ADAPTIVE else None
+    if metric is None:
+        parts = urlsplit(url)
+        metric = '{} {}{}'.format(method, parts.netloc, parts.path)
+    sent = body_size(kwargs.get('data'))
+
+    for attempt in range(retries + 1):
+        if limiter: limiter.acquire()
+        t = time()
+        error = None
+        # until an answer is in, any exception (broken chunked body, redirect
+        # loop, bad url...) counts as a failure: the slot is always returned
+        outcome = dict(failed=True)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+            latency = time() - t
+            throttled = response.status_code in THROTTLE_STATUS
+            wait = retry_after(response) if throttled else None
+            outcome = dict(latency=latency, throttled=throttled, failed=response.status_code >= 500, retry_after=wait)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        finally:
+            if limiter: limiter.release(t, metric, **outcome)
+
+        if error is not None:
+            debug_toolkit.metrics.observe(metric, time() - t, error=True, sent=sent)
+            # a dropped connection or read timeout may come after the server took the request
+            if attempt == retries or (method not in IDEMPOTENT and not unsent(error)):
+                raise error
+            reason = error.__class__.__name__
+            delay = backoff(attempt)
+        else:
+            debug_toolkit.metrics.observe(metric, latency, error=not response.ok, sent=sent,
+                                          received=int(response.headers.get('Content-Length') or len(response.content)))
+            if not retryable(method, response.status_code, wait) or attempt == retries:
+                return response
+            reason = response.status_code
+            delay = backoff(attempt) if wait is None else wait
+
+        if debug_toolkit.TRACE: print("[http] {} {} failed ({}), retry in {:.2f} s".format(method, url, reason, delay))
+        sleep(delay)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
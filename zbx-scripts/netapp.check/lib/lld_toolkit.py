@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+from time import time
+
+import cache_toolkit
+
+
+FLUSH_EVERY = 1000
+STATE_FILE = os.path.join(cache_toolkit.CACHE_DIR, 'lld_fingerprints.json')
+MAX_AGE = 3600
+
+
+def encoder(fast=False):
+    """json.dumps, or orjson when fast and installed.
+
+    json.dumps output is byte-for-byte what json.dumps of the whole
+    document gives; orjson is compact and keeps non-ASCII as UTF-8, which
+    is still valid for Zabbix but not byte-identical.
+    """
+    if fast:
+        try:
+            import orjson
+            return lambda obj: orjson.dumps(obj).decode('utf-8')
+        except ImportError:
+            pass
+    return json.dumps
+
+
+def write_array(records, stream=None, fast=False, flush_every=FLUSH_EVERY):
+    """Write records as a json array while they are produced; returns the count"""
+    stream = stream or sys.stdout
+    dumps = encoder(fast)
+    count = 0
+    stream.write('[')
+    for record in records:
+        if count:
+            stream.write(', ')
+        stream.write(dumps(record))
+        count += 1
+        if count % flush_every == 0:
+            stream.flush()
+    stream.write(']')
+    return count
+
+
+def write_discovery(records, stream=None, fast=False, flush_every=FLUSH_EVERY):
+    """Write {"data": [...]} LLD json while records are produced, same bytes as print(json.dumps(...))"""
+    stream = stream or sys.stdout
+    stream.write('{"data": ')
+    count = write_array(records, stream, fast, flush_every)
+    stream.write('}\n')
+    stream.flush()
+    return count
+
+
+def fingerprint(data):
+    """Hash of an LLD macro set, independent of the order of the entities"""
+    import hashlib
+    entities = sorted(json.dumps(entity, sort_keys=True) for entity in data)
+    return hashlib.sha1('\n'.join(entities).encode('utf-8')).hexdigest()
+
+
+class DiscoveryState(object):
+    """Fingerprints of the last LLD payloads sent, kept between runs.
+
+    changed() tells whether a payload has to be sent: the macro set differs
+    from the last one sent under that key, or max_age seconds have passed
+    (so Zabbix keeps seeing the rule alive). Nothing is remembered until
+    commit() is called for the keys that were actually delivered.
+    """
+    def __init__(self, path=STATE_FILE, max_age=MAX_AGE):
+        super(DiscoveryState, self).__init__()
+        self.path       = path
+        self.max_age    = max_age
+        self.state      = cache_toolkit.read_json(path) or {}
+        self.pending    = {}
+
+    def changed(self, key, data):
+        current = fingerprint(data)
+        last = self.state.get(key)
+        if last and last['fingerprint'] == current and time() - last['sent'] < self.max_age:
+            return False
+        self.pending[key] = current
+        return True
+
+    def commit(self, keys=None):
+        """Remember the pending fingerprints of keys (default: all) as sent now"""
+        now = time()
+        for key in list(self.pending if keys is None else keys):
+            self.state[key] = {'fingerprint': self.pending.pop(key), 'sent': now}
+        os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+        cache_toolkit.write_json(self.path, self.state)
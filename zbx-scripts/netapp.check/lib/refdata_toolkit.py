@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+from time import time
+
+import debug_toolkit
+import cache_toolkit
+import sn_toolkit
+import sync_toolkit
+import zbx_toolkit
+
+
+REFDATA_DIR = os.path.join(cache_toolkit.CACHE_DIR, 'refdata')
+MAX_AGE = 24 * 3600         # refetched after this whatever the change check says
+
+# seconds a dataset is used without asking the server at all
+TTLS = {
+    'zbx_templates':    3600,
+    'zbx_proxies':      3600,
+    'zbx_hostgroups':   300,
+    'sn_templates':     3600,
+    'sn_proxies':       3600,
+    'sn_locations':     6 * 3600,
+}
+
+
+class RefDataCache(object):
+    """Slow-changing reference data kept on disk between sync runs.
+
+    A dataset younger than its TTL is loaded from disk without any request.
+    Past the TTL, version() - a cheap change marker (object count and
+    highest id, latest sys_updated_on) - is compared with the stored one; the data is
+    only downloaded again when it differs, or when the copy is older than
+    max_age. Datasets are stored already indexed, ready to use.
+    """
+    def __init__(self, cache_dir=REFDATA_DIR, ttls=TTLS, max_age=MAX_AGE):
+        super(RefDataCache, self).__init__()
+        self.cache_dir  = cache_dir
+        self.ttls       = ttls
+        self.max_age    = max_age
+        cache_toolkit.private_dir(self.cache_dir)
+
+    def _path(self, name, source):
+        return os.path.join(self.cache_dir, '{}_{}.json'.format(name, cache_toolkit.cache_key(source)))
+
+    def get(self, name, source, fetch, version=None, index=None):
+        """Dataset name of source (server), fetch()ed and index()ed when the stored copy is out of date"""
+        path = self._path(name, source)
+        entry = cache_toolkit.read_json(path)
+        now = time()
+        if entry is not None and now - entry['checked'] < self.ttls.get(name, 0):
+            if debug_toolkit.TRACE: print("[refdata] {} from disk".format(name))
+            return entry['value']
+
+        current = version() if version else None
+        if entry is not None and current is not None and current == entry['version'] and now - entry['fetched'] < self.max_age:
+            if debug_toolkit.TRACE: print("[refdata] {} unchanged ({})".format(name, current))
+            entry['checked'] = now
+            cache_toolkit.write_json(path, entry)
+            return entry['value']
+
+        if debug_toolkit.TRACE: print("[refdata] {} download".format(name))
+        value = fetch()
+        if index:
+            value = index(value)
+        cache_toolkit.write_json(path, {'version': current, 'fetched': now, 'checked': now, 'value': value})
+        return value
+
+    def invalidate(self, name, source):
+        """Forget a dataset we just changed ourselves (e.g. after create_hostgroups)"""
+        try:
+            os.unlink(self._path(name, source))
+        except FileNotFoundError:
+            pass
+
+
+def index_sys_id(records):
+    """sys_id -> record, the sn_*_index shape sort_info expects"""
+    return {sync_toolkit.field_value(record, 'sys_id'): record for record in records}
+
+
+def zbx_templates(cache, token, host):
+    """get_templates_api output: [{'host', 'templateid' (int)}]"""
+    def fetch():
+        templates = zbx_toolkit.get_items(token, host, 'template', output=["host", "templateid"])
+        return [{'host': elem['host'], 'templateid': int(elem['templateid'])} for elem in templates]
+    return cache.get('zbx_templates', host, fetch, version=lambda: zbx_toolkit.objects_version(token, host, 'template', 'templateid'))
+
+
+def zbx_proxies(cache, token, host):
+    return cache.get('zbx_proxies', host, lambda: zbx_toolkit.get_items(token, host, 'proxy'),
+                     version=lambda: zbx_toolkit.objects_version(token, host, 'proxy', 'proxyid'))
+
+
+def zbx_hostgroups(cache, token, host):
+    return cache.get('zbx_hostgroups', host, lambda: zbx_toolkit.get_hostgroups(token, host),
+                     version=lambda: zbx_toolkit.objects_version(token, host, 'hostgroup', 'groupid'))
+
+
+def sn_index(cache, name, server, user, password, table, query=""):
+    """sys_id index of a ServiceNow reference table (sn_templates, sn_proxies, sn_locations)"""
+    return cache.get(name, server + '/' + table + '?' + query,
+                     lambda: sn_toolkit.get_table_records(server, user, password, table, query),
+                     version=lambda: sn_toolkit.table_version(server, user, password, table, query),
+                     index=index_sys_id)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import json
+import re
+import shlex
+import socket
+import struct
+import zlib
+from time import time
+
+import debug_toolkit
+
+
+ZBX_HEADER      = b'ZBXD'
+ZBX_FLAG        = 0x01
+ZBX_FLAG_ZLIB   = 0x02
+PORT            = 10051
+BATCH_SIZE      = 250       # same chunk size as zabbix_sender
+TIMEOUT         = 10
+INFO_RE         = re.compile(r'processed: (\d+); failed: (\d+); total: (\d+); seconds spent: ([\d.]+)')
+
+
+class SenderError(Exception):
+    pass
+
+
+class SenderResult(object):
+    """Totals parsed from the trapper 'info' replies"""
+    def __init__(self, processed=0, failed=0, total=0, seconds=0.0, batches=0):
+        super(SenderResult, self).__init__()
+        self.processed  = processed
+        self.failed     = failed
+        self.total      = total
+        self.seconds    = seconds
+        self.batches    = batches
+
+    def __add__(self, other):
+        return SenderResult(self.processed + other.processed, self.failed + other.failed, self.total + other.total,
+                            self.seconds + other.seconds, self.batches + other.batches)
+
+    def __repr__(self):
+        return 'processed: {}; failed: {}; total: {}; seconds spent: {:.6f}; batches: {}'.format(
+            self.processed, self.failed, self.total, self.seconds, self.batches)
+
+    @classmethod
+    def from_response(cls, response):
+        if response.get('response') != 'success':
+            raise SenderError('Incorrect response from trapper: {}'.format(response))
+        match = INFO_RE.search(response.get('info', ''))
+        if not match:
+            return cls(batches=1)
+        processed, failed, total, seconds = match.groups()
+        return cls(int(processed), int(failed), int(total), float(seconds), 1)
+
+
+def pack(data, compress=False):
+    body = json.dumps(data).encode('utf-8')
+    if compress:
+        packed = zlib.compress(body)
+        return ZBX_HEADER + struct.pack('<BII', ZBX_FLAG | ZBX_FLAG_ZLIB, len(packed), len(body)) + packed
+    return ZBX_HEADER + struct.pack('<BII', ZBX_FLAG, len(body), 0) + body
+
+
+def recv_exact(sock, size):
+    chunks, left = [], size
+    while left:
+        chunk = sock.recv(left)
+        if not chunk:
+            raise SenderError('Connection closed by trapper')
+        chunks.append(chunk)
+        left -= len(chunk)
+    return b''.join(chunks)
+
+
+def unpack(sock):
+    header = recv_exact(sock, 13)
+    if header[:4] != ZBX_HEADER:
+        raise SenderError('Incorrect trapper header: {!r}'.format(header))
+    flags, datalen, reserved = struct.unpack('<BII', header[4:])
+    body = recv_exact(sock, datalen)
+    if flags & ZBX_FLAG_ZLIB:
+        body = zlib.decompress(body)
+    return json.loads(body.decode('utf-8'))
+
+
+class ZabbixSender(object):
+    """Zabbix trapper protocol client (what zabbix_sender does, without the fork).
+
+    The connection is kept between batches for as long as the server or
+    proxy keeps it open, and re-established transparently otherwise.
+    """
+    def __init__(self, server='127.0.0.1', port=PORT, timeout=TIMEOUT, batch_size=BATCH_SIZE, compress=False):
+        super(ZabbixSender, self).__init__()
+        self.server     = server
+        self.port       = int(port)
+        self.timeout    = timeout
+        self.batch_size = batch_size
+        self.compress   = compress
+        self.sock       = None
+
+    def connect(self):
+        if self.sock is not None and self._alive():
+            return self.sock
+        self.close()
+        self.sock = socket.create_connection((self.server, self.port), timeout=self.timeout)
+        return self.sock
+
+    def _alive(self):
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send_batch(self, values):
+        request = {'request': 'sender data', 'data': values, 'clock': int(time())}
+        for attempt in (1, 2):
+            sock = self.connect()
+            try:
+                sock.sendall(pack(request, self.compress))
+                response = unpack(sock)
+                break
+            except (SenderError, OSError):
+                # stale keep-alive connection: retry once on a fresh one
+                self.close()
+                if attempt == 2:
+                    raise
+        result = SenderResult.from_response(response)
+        if debug_toolkit.TRACE: print("[sender] {}:{} {}".format(self.server, self.port, result))
+        return result
+
+    def send(self, values):
+        """Send [{'host', 'key', 'value'[, 'clock']}] in bounded batches, return the summed SenderResult"""
+        result = SenderResult()
+        for start in range(0, len(values), self.batch_size):
+            result += self.send_batch(values[start:start + self.batch_size])
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_agent_config(path):
+    config = {}
+    with open(path, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                config[key.strip()] = value.strip()
+    return config
+
+
+def parse_sender_param(sender_param):
+    """Take server, port and default host from zabbix_sender style arguments (-c/-z/-p/-s)"""
+    options = {}
+    args = list(sender_param)
+    for flag, name in (('-c', 'config'), ('-z', 'server'), ('-p', 'port'), ('-s', 'host')):
+        if flag in args and args.index(flag) + 1 < len(args):
+            options[name] = args[args.index(flag) + 1]
+
+    server, port, host = '127.0.0.1', PORT, options.get('host')
+    if 'config' in options:
+        config = read_agent_config(options['config'])
+        active = (config.get('ServerActive') or config.get('Server') or server).split(',')[0].strip()
+        server, _, config_port = active.partition(':')
+        port = config_port or port
+        host = host or config.get('Hostname')
+
+    server = options.get('server', server)
+    port = int(options.get('port', port))
+    return server, port, host
+
+
+def parse_sender_items(sender_items, default_host=None):
+    """zabbix_sender -i input ('<host> <key> <value>' per line, '-' for the default host) to trapper values"""
+    values = []
+    for line in sender_items.splitlines():
+        if not line.strip():
+            continue
+        host, key, *value = shlex.split(line)
+        values.append({'host': default_host if host == '-' else host, 'key': key, 'value': " ".join(value)})
+    return values
@@ -1,31 +1,116 @@
 #!/usr/bin/env python3
 
-import requests
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 import json
 
 import debug_toolkit
+import http_toolkit
 from debug_toolkit import deflogger, dry_request
 
 HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
-TIMEOUT=10
+TIMEOUT=http_toolkit.TIMEOUT
 LOGGER=False
+PAGE_SIZE=1000
+TABLE_URL='http://{}/api/now/table/{}'
+WORKERS=4
 
 @deflogger
 def get_table_records(server, user, password, table, query="", DRYRUN=False):
-    url = 'http://{}/api/now/table/{}?{}'.format(server,table,query)
+    url = table_url(server, table) + '?' + query
     
     if debug_toolkit.DRYRUN and DRYRUN: 
         dry_request(url=url, headers=HEADERS)
     else:
-        response = requests.get (url=url, headers=HEADERS, timeout=TIMEOUT, auth=(user, password), verify=False)
+        response = http_toolkit.get(url=url, headers=HEADERS, auth=(user, password))
         if 'result' in response.json().keys():
             return response.json()['result']
         else:
             print('Error! Incorrect response from get_table_records.\n', response.json())
             exit()
 
+def table_url(server, table):
+    # server may carry its own scheme (https://instance)
+    if '://' in server:
+        return '{}/api/now/table/{}'.format(server.rstrip('/'), table)
+    return TABLE_URL.format(server, table)
+
+
+def add_condition(query, condition):
+    """Append an (encoded) condition to the sysparm_query of a Table API query string"""
+    params = [param for param in query.split('&') if param]
+    for index, param in enumerate(params):
+        if param.startswith('sysparm_query='):
+            params[index] = param + '%5E' + condition
+            break
+    else:
+        params.append('sysparm_query=' + condition)
+    return '&'.join(params)
+
+
+def table_version(server, user, password, table, query=""):
+    """Cheap change marker of a table: 'count|latest sys_updated_on', one single-record request"""
+    records, total = get_table_page(server, user, password, table, add_condition(query, 'ORDERBYDESCsys_updated_on'),
+                                    0, 1, fields=['sys_updated_on'])
+    if records is None:
+        return None
+    updated = records[0].get('sys_updated_on') if records else ''
+    if isinstance(updated, dict):
+        updated = updated.get('value')
+    return '{}|{}'.format(total, updated)
+
+
+def get_table_page(server, user, password, table, query, offset, limit, fields=None):
+    """One sysparm_limit/sysparm_offset page: (records or None, X-Total-Count or None)"""
+    url = table_url(server, table) + '?' + query
+    params = {'sysparm_limit': limit, 'sysparm_offset': offset}
+    if fields: params['sysparm_fields'] = ','.join(fields)
+
+    response = http_toolkit.get(url=url, params=params, headers=HEADERS, auth=(user, password))
+    body = response.json()
+    total = response.headers.get('X-Total-Count')
+    return body.get('result'), int(total) if total is not None else None
+
+
+@deflogger
+def iter_table_records(server, user, password, table, query="", fields=None, page_size=PAGE_SIZE, workers=WORKERS, DRYRUN=False):
+    """Stream table records page by page, fetching up to `workers` pages concurrently.
+
+    fields limits the transferred columns (sysparm_fields), e.g. sort_info.CI_FIELDS.
+    Records are yielded ordered by sys_id (after any ORDERBY of the query):
+    without a total order, offset pages may overlap or skip rows.
+    """
+    query = add_condition(query, 'ORDERBYsys_id')
+    if debug_toolkit.DRYRUN and DRYRUN:
+        dry_request(url=table_url(server, table) + '?' + query, headers=HEADERS)
+        return
+
+    records, total = get_table_page(server, user, password, table, query, 0, page_size, fields)
+    if records is None:
+        print('Error! Incorrect response from iter_table_records.')
+        exit()
+    yield from records
+
+    if total is None:
+        # no X-Total-Count: walk the pages one by one until a short one
+        offset = page_size
+        while len(records) == page_size:
+            records, _ = get_table_page(server, user, password, table, query, offset, page_size, fields)
+            if records is None:
+                print('Error! Incorrect response from iter_table_records.')
+                exit()
+            yield from records
+            offset += page_size
+        return
+
+    def get_page(offset):
+        return get_table_page(server, user, password, table, query, offset, page_size, fields)
+
+    for records, _ in http_toolkit.map_ordered(get_page, range(page_size, total, page_size), workers):
+        if records is None:
+            print('Error! Incorrect response from iter_table_records.')
+            exit()
+        yield from records
+
+
 @deflogger
 def find_sys_id(field, value, data):
     for record in data:
@@ -34,13 +119,13 @@ def find_sys_id(field, value, data):
 
 @deflogger
 def delete_table_record(table, uid, server, user, password):
-    url = 'http://{}/api/now/table/{}/{}'.format(server,table,uid)
+    url = table_url(server, table) + '/' + uid
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, method='delete')
     else:
-        response = requests.delete(url, auth=(user, password), headers=headers)
+        response = http_toolkit.delete(url, auth=(user, password), headers=headers)
         if response.status_code == 204:
             print('Запись успешно удалена.')
         else:
@@ -48,7 +133,7 @@ def delete_table_record(table, uid, server, user, password):
 
 @deflogger
 def modify_table_records(table, uid, new_value, server, user, password):
-    url = 'http://{}/api/now/table/{}/{}'.format(server, table, uid)
+    url = table_url(server, table) + '/' + uid
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
     #payload = dict(name=new_value)
     payload = dict(host=new_value)
@@ -56,7 +141,7 @@ def modify_table_records(table, uid, new_value, server, user, password):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, method='put', payload=payload)
     else:
-        response = requests.put(url, auth=(user, password), headers=headers, data=json.dumps(payload))
+        response = http_toolkit.put(url, auth=(user, password), headers=headers, data=json.dumps(payload))
         if response.status_code == 200:
             print(' Выполнено.')
         else:
@@ -65,7 +150,7 @@ def modify_table_records(table, uid, new_value, server, user, password):
 
 @deflogger
 def create_table_record(table, new_keys, id_field, server, user, password):
-    url = 'http://{}/api/now/table/{}'.format(server,table)
+    url = table_url(server, table)
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
     #for key, value in new_keys.items():
         #payload = dict(id=key, name=value)
@@ -77,7 +162,7 @@ def create_table_record(table, new_keys, id_field, server, user, password):
        	if debug_toolkit.DRYRUN: 
             dry_request(url=url, headers=HEADERS, method='post', payload=json.dumps(payload))
         else:
-            response = requests.post(url, auth=(user, password), headers=headers, data=json.dumps(payload))
+            response = http_toolkit.post(url, auth=(user, password), headers=headers, data=json.dumps(payload))
             if response.status_code == 201:
                 print('Создана следующая запись "{} - {}"'.format(key, value))
                 if debug_toolkit.DEBUG: print(response.json())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import sqlite3
+from time import time
+
+import debug_toolkit
+import cache_toolkit
+import sort_info
+
+
+SNAPSHOT_FILE = os.path.join(cache_toolkit.CACHE_DIR, 'zbx_hosts_snapshot.sqlite')
+MAX_AGE = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts  (hostid TEXT PRIMARY KEY, alias TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS hosts_alias ON hosts (alias);
+CREATE TABLE IF NOT EXISTS groups (groupid TEXT PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta   (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class HostSnapshot(object):
+    """Local copy of the Zabbix host state used by the sync.
+
+    Hosts are stored as host.get output (selectInventory, selectGroups,
+    selectParentTemplates, selectInterfaces), indexed by hostid and inventory
+    alias. refresh() replaces everything from a full host.get; in between the
+    snapshot follows our own create_hosts/apply_host_updates results.
+    """
+    def __init__(self, path=SNAPSHOT_FILE):
+        super(HostSnapshot, self).__init__()
+        self.path   = path
+        if path == SNAPSHOT_FILE:
+            cache_toolkit.private_dir(os.path.dirname(path))
+        self.db     = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        os.chmod(path, 0o600)
+
+    def close(self):
+        self.db.close()
+
+    def last_refresh(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_refresh'").fetchone()
+        return float(row[0]) if row else 0
+
+    def is_stale(self, max_age=MAX_AGE):
+        return time() - self.last_refresh() >= max_age
+
+    def refresh(self, zbx_hosts, zbx_groups=None):
+        """Replace the snapshot with a full host.get (and hostgroup.get) result; zbx_hosts may be a stream"""
+        with self.db:
+            self.db.execute("DELETE FROM hosts")
+            self._upsert(zbx_hosts)
+            if zbx_groups is not None:
+                self.db.execute("DELETE FROM groups")
+                self.set_groups(zbx_groups)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_refresh', ?)", (str(time()),))
+        if debug_toolkit.DEBUG: print("[snapshot] refreshed: {} hosts".format(self.db.execute("SELECT COUNT(*) FROM hosts").fetchone()[0]))
+
+    def set_groups(self, zbx_groups):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO groups VALUES (?, ?)",
+                                [(group['groupid'], group['name']) for group in zbx_groups])
+
+    def _upsert(self, zbx_hosts):
+        self.db.executemany("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?)",
+                            ((host['hostid'], (host.get('inventory') or {}).get('alias'), json.dumps(host)) for host in zbx_hosts))
+
+    def upsert(self, zbx_hosts):
+        with self.db:
+            self._upsert(zbx_hosts)
+
+    def delete(self, hostids):
+        with self.db:
+            self.db.executemany("DELETE FROM hosts WHERE hostid = ?", [(hostid,) for hostid in hostids])
+
+    def get(self, hostid):
+        row = self.db.execute("SELECT data FROM hosts WHERE hostid = ?", (hostid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def by_alias(self, alias):
+        row = self.db.execute("SELECT data FROM hosts WHERE alias = ?", (alias,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def hosts(self):
+        for (data,) in self.db.execute("SELECT data FROM hosts"):
+            yield json.loads(data)
+
+    def groups(self):
+        return [{'groupid': groupid, 'name': name} for groupid, name in self.db.execute("SELECT groupid, name FROM groups")]
+
+    def index(self):
+        """sys_id -> host, as sort_info.index_zbx_hosts builds it from host.get"""
+        return sort_info.index_zbx_hosts(self.hosts())
+
+    def apply_update(self, host_id, changes):
+        """Apply one data_for_updating entry (sort_zbx_hosts_for_updating) that Zabbix accepted"""
+        host = self.get(host_id)
+        if host is None:
+            return
+        # groups the host already had keep their names even when the groups table lacks them
+        group_names = {str(group['groupid']): group.get('name', '') for group in host.get('groups', [])}
+        group_names.update(self.db.execute("SELECT groupid, name FROM groups"))
+
+        if 'host' in changes: host['host'] = changes['host']
+        if changes.get('name'): host['name'] = changes['name']
+        if 'templates' in changes:
+            host['parentTemplates'] = [{'templateid': str(templateid)} for templateid in changes['templates']]
+        if 'groups' in changes:
+            host['groups'] = [{'groupid': group['groupid'], 'name': group_names.get(str(group['groupid']), '')} for group in changes['groups']]
+        if 'location' in changes:
+            inventory = host.get('inventory') or {}
+            inventory.update(location=changes['location'], location_lat=changes['latitude'], location_lon=changes['longitude'])
+            host['inventory'] = inventory
+        for interface in host.get('interfaces', []):
+            if interface['interfaceid'] != changes.get('interface_id'):
+                continue
+            if 'ip_address' in changes: interface['ip'] = changes['ip_address']
+            if 'dns' in changes: interface['dns'] = changes['dns']
+            if 'interface_type' in changes: interface['type'] = str(changes['interface_type'])
+
+        self.upsert([host])
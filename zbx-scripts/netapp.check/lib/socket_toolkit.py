@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import struct
+
+import cache_toolkit
+
+
+# in the private per-user cache directory: nobody else can bind it first
+SOCKET_PATH = os.path.join(cache_toolkit.CACHE_DIR, 'netapp_ocum_query.sock')
+SOCKET_MODE = 0o660
+TIMEOUT = 30
+
+
+class SocketError(Exception):
+    pass
+
+
+def peer_uid(sock):
+    """uid of the process at the other end of a connected Unix socket"""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def request(path, message, timeout=TIMEOUT, peer=None):
+    """Send one json message to a Unix socket server, return the whole reply (bytes)
+
+    With peer (a uid), a server run by any other user is refused.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        if peer is not None and peer_uid(sock) != peer:
+            raise SocketError('{}: served by uid {}, not {}'.format(path, peer_uid(sock), peer))
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError as e:
+        raise SocketError('{}: {}'.format(path, e))
+    finally:
+        sock.close()
+    return b''.join(chunks)
+
+
+def in_use(path):
+    """True when a server is listening on path"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(path, handle, mode=SOCKET_MODE):
+    """Serve json line requests on a Unix socket, one thread per connection.
+
+    handle(message, stream) writes the reply to the text stream; the
+    connection is closed when it returns.
+    """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                # in_use() probe
+                return
+            stream = io.TextIOWrapper(self.wfile, encoding='utf-8')
+            try:
+                handle(json.loads(line), stream)
+                stream.flush()
+            except (ValueError, BrokenPipeError) as e:
+                print("[socket] bad request or client gone: {}".format(e))
+            finally:
+                stream.detach()
+
+    if path == SOCKET_PATH:
+        cache_toolkit.private_dir(os.path.dirname(path))
+    if os.path.exists(path):
+        if in_use(path):
+            raise SocketError('{}: already served by another process'.format(path))
+        os.unlink(path)
+
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    os.chmod(path, mode)
+    # stopped by the service manager: still remove the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
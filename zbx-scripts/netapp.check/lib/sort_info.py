@@ -7,6 +7,11 @@ import debug_toolkit
 from debug_toolkit import deflogger, dry_request
 
 
+# CI columns read by the functions below (sn_toolkit.iter_table_records fields=)
+CI_FIELDS = ['sys_id', 'name', 'sys_class_name', 'ip_address', 'fqdn', 'location',
+             'x_itgra_monitoring_zabbix_template', 'x_itgra_monitoring_zabbix_proxy']
+
+
 @deflogger
 def sort_sn_hosts_with_templates(row_hosts):
     sorted_hosts = []
@@ -22,7 +27,7 @@ def sort_sn_hosts_with_templates(row_hosts):
 
 @deflogger
 def compare_and_find_new_hosts(zbx_hosts, sn_cis):
-    zabbix_uids = [host['inventory']['alias'] for host in zbx_hosts if host['inventory']]
+    zabbix_uids = set(host['inventory']['alias'] for host in zbx_hosts if host['inventory'])
     new, old = None, None
     new = [item for item in sn_cis if item['sys_id']["value"] not in zabbix_uids]
     old = [item for item in sn_cis if item['sys_id']["value"] in zabbix_uids]
@@ -31,8 +36,8 @@ def compare_and_find_new_hosts(zbx_hosts, sn_cis):
 
 @deflogger
 def compare_and_find_new_groups(hosts, old_groups):
-    new_classes = list(set([host['sys_class_name']["display_value"] for host in hosts]))
-    old_group_names = list(set([item['name'] for item in old_groups]))
+    new_classes = set(host['sys_class_name']["display_value"] for host in hosts)
+    old_group_names = set(item['name'] for item in old_groups)
     new_groups = ['ServiceNow/CMDB/' + nc for nc in new_classes if 'ServiceNow/CMDB/' + nc not in old_group_names]
     if new_groups:
         return new_groups
@@ -90,6 +95,7 @@ def sort_zbx_hosts_for_creating(zbx_hosts, sn_templates_index, sn_proxies_index,
 @deflogger
 def sort_zbx_hosts_for_updating(sn_old_hosts, zbx_old_hosts, zbx_sn_groups, export_group_id, sn_templates_indexed, sn_locations_index):
     data_for_updating = {}
+    groupids_index = index_groups(zbx_sn_groups)
     for sn_host in sn_old_hosts:
         alias = sn_host["sys_id"]["value"]
         host_id = zbx_old_hosts[alias]["hostid"]
@@ -106,6 +112,7 @@ def sort_zbx_hosts_for_updating(sn_old_hosts, zbx_old_hosts, zbx_sn_groups, expo
         new_templates = []
         sn_host_templates = sn_host['x_itgra_monitoring_zabbix_template']["value"]
         zbx_host_templates = zbx_old_hosts[alias]["templates"]
+        zbx_host_templates_set = set(zbx_host_templates)
         #print(sn_host)
 
         for tpl in sn_host_templates:
@@ -113,7 +120,7 @@ def sort_zbx_hosts_for_updating(sn_old_hosts, zbx_old_hosts, zbx_sn_groups, expo
                 print ("[warn] can't find template with sys_id " + tpl + 'for host' + sn_host["name"]["value"])
                 break
             #print(tpl)
-            if sn_templates_indexed[tpl]['templateid'] not in zbx_host_templates:
+            if sn_templates_indexed[tpl]['templateid'] not in zbx_host_templates_set:
                 new_templates.append(sn_templates_indexed[tpl]['templateid'])
         if new_templates:
             zbx_host_templates.extend(new_templates)
@@ -153,10 +160,9 @@ def sort_zbx_hosts_for_updating(sn_old_hosts, zbx_old_hosts, zbx_sn_groups, expo
             pass
         else:
             data_for_updating[host_id]["groups"] = [{"groupid":export_group_id}]
-            for zbx_sn_group in zbx_sn_groups:
-                if zbx_sn_group["name"] == "ServiceNow/CMDB/" + sn_host["sys_class_name"]["display_value"]:
-                    data_for_updating[host_id]["groups"].append({"groupid":zbx_sn_group["groupid"]})
-                    break
+            groupid = groupids_index.get("ServiceNow/CMDB/" + sn_host["sys_class_name"]["display_value"])
+            if groupid is not None:
+                data_for_updating[host_id]["groups"].append({"groupid":groupid})
         
 
         # update location
@@ -168,4 +174,53 @@ def sort_zbx_hosts_for_updating(sn_old_hosts, zbx_old_hosts, zbx_sn_groups, expo
 
         if not data_for_updating[host_id]:
             del(data_for_updating[host_id])
-    return data_for_updating
\ No newline at end of file
+    return data_for_updating
+
+
+def index_groups(zbx_groups):
+    """group name -> groupid (first one wins, as the former linear scan did)"""
+    index = {}
+    for group in zbx_groups:
+        index.setdefault(group["name"], group["groupid"])
+    return index
+
+
+def index_zbx_hosts(zbx_hosts):
+    """sys_id (inventory alias) -> host, in the shape sort_zbx_hosts_for_updating expects
+
+    zbx_hosts is host.get output with selectInventory/selectGroups/
+    selectParentTemplates/selectInterfaces (zbx_toolkit.iter_hosts); any
+    iterable, it is read once.
+    """
+    index = {}
+    for host in zbx_hosts:
+        inventory = host.get("inventory") or {}
+        if not inventory.get("alias"):
+            continue
+        index[inventory["alias"]] = {
+            "hostid":       host["hostid"],
+            "name":         host["name"],
+            "host":         host["host"],
+            "templates":    [template["templateid"] if isinstance(template, dict) else template for template in host["parentTemplates"]],
+            "interfaces":   host["interfaces"],
+            "groups":       host["groups"],
+            "location":     inventory.get("location", ""),
+        }
+    return index
+
+
+@deflogger
+def reconcile(sn_cis, zbx_hosts_index, zbx_sn_groups, export_group_id, sn_templates_indexed, sn_locations_index):
+    """Partition ServiceNow CIs against Zabbix hosts in linear time.
+
+    zbx_hosts_index is index_zbx_hosts() output. Returns (new, changed,
+    unchanged): CIs missing in Zabbix, data_for_updating for hosts that
+    differ, and CIs already in sync.
+    """
+    new, old = [], []
+    for ci in sn_cis:
+        (old if ci["sys_id"]["value"] in zbx_hosts_index else new).append(ci)
+
+    changed = sort_zbx_hosts_for_updating(old, zbx_hosts_index, zbx_sn_groups, export_group_id, sn_templates_indexed, sn_locations_index)
+    unchanged = [ci for ci in old if zbx_hosts_index[ci["sys_id"]["value"]]["hostid"] not in changed]
+    return new, changed, unchanged
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os
+import zlib
+import fcntl
+from time import time
+from urllib.parse import quote
+
+import debug_toolkit
+import cache_toolkit
+import sn_toolkit
+import sort_info
+import zbx_toolkit
+from debug_toolkit import deflogger
+
+
+STATE_FILE = os.path.join(cache_toolkit.CACHE_DIR, 'zbx_sn_sync_state.json')
+FULL_RESYNC_INTERVAL = 24 * 3600
+WATERMARK_FIELD = 'sys_updated_on'
+GROUPS_LOCK = os.path.join(cache_toolkit.CACHE_DIR, 'zbx_sn_sync_groups.lock')
+
+
+def load_state(state_file=STATE_FILE):
+    return cache_toolkit.read_json(state_file) or {}
+
+
+def save_state(state, state_file=STATE_FILE):
+    # the default state files (shards included) live in the private cache directory
+    if os.path.dirname(state_file) == cache_toolkit.CACHE_DIR:
+        cache_toolkit.private_dir(cache_toolkit.CACHE_DIR)
+    cache_toolkit.write_json(state_file, state)
+
+
+def field_value(record, field):
+    # sysparm_display_value=all returns {'value', 'display_value'}; value is UTC
+    value = record.get(field)
+    return value.get('value') if isinstance(value, dict) else value
+
+
+def since_query(query, watermark, field=WATERMARK_FIELD):
+    """Add '<field> >= watermark' to the sysparm_query of a Table API query string
+
+    >= rather than >: CIs updated within the watermark second are re-read
+    instead of being missed; applying them twice is harmless.
+    """
+    day, _, clock = watermark.partition(' ')
+    condition = quote("{}>=javascript:gs.dateGenerate('{}','{}')".format(field, day, clock or '00:00:00'))
+    return sn_toolkit.add_condition(query, condition)
+
+
+@deflogger
+def get_changed_records(server, user, password, table, query="", fields=None, state_file=STATE_FILE,
+                        full_resync_interval=FULL_RESYNC_INTERVAL):
+    """Records changed since the stored watermark, or the whole table when a full resync is due.
+
+    Returns (records, full, watermark). Pass the watermark to commit_watermark()
+    once the records have been applied, so a failed run is retried.
+    """
+    state = load_state(state_file)
+    full = not state.get('watermark') or time() - state.get('last_full', 0) >= full_resync_interval
+    if not full:
+        query = since_query(query, state['watermark'])
+    if fields and WATERMARK_FIELD not in fields:
+        fields = list(fields) + [WATERMARK_FIELD]
+
+    records = list(sn_toolkit.iter_table_records(server, user, password, table, query=query, fields=fields))
+    watermark = max([field_value(record, WATERMARK_FIELD) or '' for record in records] + [state.get('watermark') or ''])
+    if debug_toolkit.DEBUG:
+        print("[sync] {} mode, {} records, watermark {}".format('full' if full else 'incremental', len(records), watermark))
+    return records, full, watermark or None
+
+
+def commit_watermark(watermark, full, state_file=STATE_FILE):
+    if debug_toolkit.DRYRUN:
+        return
+    state = load_state(state_file)
+    state['watermark'] = watermark
+    if full:
+        state['last_full'] = time()
+    save_state(state, state_file)
+
+
+def partition(sys_id, partitions):
+    """Stable shard of a CI: the same sys_id lands in the same partition on every worker and run"""
+    return zlib.crc32(sys_id.encode('utf-8')) % partitions
+
+
+def shard_records(records, shard, partitions):
+    """ServiceNow CIs of one shard"""
+    return [record for record in records if partition(field_value(record, 'sys_id'), partitions) == shard]
+
+
+def shard_hosts_index(zbx_hosts_index, shard, partitions):
+    """sort_info.index_zbx_hosts entries (keyed by sys_id) of one shard"""
+    return {sys_id: host for sys_id, host in zbx_hosts_index.items() if partition(sys_id, partitions) == shard}
+
+
+def shard_state_file(shard, partitions, state_file=STATE_FILE):
+    """Each shard keeps its own watermark"""
+    base, ext = os.path.splitext(state_file)
+    return '{}.{}of{}{}'.format(base, shard, partitions, ext)
+
+
+@deflogger
+def ensure_groups(cis, token, server, lock_file=GROUPS_LOCK, snapshot=None):
+    """Create the host groups the CIs need, one worker at a time; returns the host groups after it.
+
+    Shards run this before reconciling: under the lock every worker sees
+    the groups created by the previous one, so none is created twice.
+    A snapshot_toolkit.HostSnapshot gets the resulting group names, those
+    created by the other workers included.
+    """
+    if lock_file == GROUPS_LOCK:
+        cache_toolkit.private_dir(cache_toolkit.CACHE_DIR)
+    with open(lock_file, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        groups = zbx_toolkit.get_hostgroups(token, server)
+        new_groups = sort_info.compare_and_find_new_groups(cis, groups)
+        if new_groups:
+            zbx_toolkit.create_hostgroups(new_groups, token, server)
+            groups = zbx_toolkit.get_hostgroups(token, server)
+    if snapshot is not None:
+        snapshot.set_groups(groups)
+    return groups
@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 
-import requests
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 import json
-from zabbix.api import ZabbixAPI
-from subprocess import Popen, PIPE, STDOUT
+import os
+import fcntl
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import debug_toolkit
+import cache_toolkit
+import http_toolkit
+import sender_toolkit
 from debug_toolkit import deflogger, dry_request
 
 
 
 HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+CHUNK_SIZE = 100
+TIMEOUT = http_toolkit.TIMEOUT
+WORKERS = 8
+HOST_CHUNK_SIZE = 1000
+INVENTORY_FIELDS = ["alias", "location", "location_lon", "location_lat"]
+API_URL = 'https://{}/zabbix/api_jsonrpc.php'
+TOKEN_CACHE = os.path.join(cache_toolkit.CACHE_DIR, 'zbx_token_cache.json')
+
+token_lock = threading.Lock()
 
 @deflogger
 def get_token(server, user, password, DRYRUN=False):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % server
+    url = api_url(server)
     payload = dict(jsonrpc='2.0',
                          method='user.login',
                          params=dict(user=user,
@@ -28,7 +40,7 @@ def get_token(server, user, password, DRYRUN=False):
     if debug_toolkit.DRYRUN and DRYRUN: 
         dry_request(url=url, headers=headers, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if 'result' in response.json().keys():
             return response.json()['result']
@@ -36,100 +48,230 @@ def get_token(server, user, password, DRYRUN=False):
             print('Error! Incorrect response from get_token.')
             exit() 
 
-def get_session_api(server, user, password):
-    session = ZabbixAPI(url='https://{}/zabbix'.format(server), user=user, password=password)
-    return session
+def api_url(server):
+    """JSON-RPC endpoint; server may carry its own scheme (http://host:port)"""
+    if '://' in server:
+        return server.rstrip('/') + '/zabbix/api_jsonrpc.php'
+    return API_URL.format(server)
 
 
-@deflogger
-def create_hostgroups(new_groups, token, server):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % server
+def api_metric(payload):
+    """debug_toolkit.metrics name of a JSON-RPC call (or batch)"""
+    if isinstance(payload, list):
+        return 'zabbix.' + (payload[0]['method'] if payload else 'batch') + '[batch]'
+    return 'zabbix.' + payload['method']
+
+
+def check_token(server, token):
+    """Cheap validity check of a session id (user.checkAuthentication, no login)"""
+    url = api_url(server)
     payload = dict(jsonrpc='2.0',
-                   method='hostgroup.create',
-                   params=dict(name=''),
-                   auth=token,
+                   method='user.checkAuthentication',
+                   params=dict(sessionid=token),
                    id=1)
-    
-    for group in new_groups:
-        payload['params']['name'] = group
+    try:
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
+        return 'result' in response.json()
+    except (http_toolkit.RequestException, ValueError):
+        return False
+
+
+def is_session_expired(response):
+    """True for the API errors that mean the auth token is no longer valid"""
+    error = response.get('error') or {}
+    return any(text in str(error.get('data', '')) for text in ('Session terminated', 'Not authorised', 'Not authorized'))
 
-        if debug_toolkit.DRYRUN: 
-            dry_request(url=url, headers=HEADERS, payload=payload)
-        else:
-            response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
-            if "error" in response.json():
-                print("Error while creating group ", group)
-            else:
-                print("The group", group, "has been created.")
 
 @deflogger
-def create_hosts(token, server, new_hosts, groupids, export_group):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % server    
-    payload = dict(jsonrpc='2.0',
-                   method='host.create',
-                   auth=token,
-                   id=1,
-                   params=dict(name='',
-                               host='',
-                               templates=[],
-                               groups=[dict(groupid='')],
-                               inventory_mode=0,
-                               interfaces=[dict(type=None,
-                                                main=1,
-                                                useip=1,
-                                                ip='',
-                                                dns='',
-                                                port='161')],
-                               inventory=dict(alias='')))
-    
-    for nh in new_hosts:
-        payload['params']['groups'] = [dict(groupid='')]
-        #if 'templates' in payload['params']:
-        payload['params']['templates'] = []
-
-        payload["params"]["name"] = nh["name"]["value"]
-        payload["params"]["host"] = nh["name"]["value"] + "_" + nh["sys_id"]["value"]
-        
-        #if nh['x_itgra_monitoring_zabbix_template']:
-
-        payload['params']['templates'] = [{'templateid': number} for number in nh['x_itgra_monitoring_zabbix_template']["value"]]
-        
-        payload['params']['inventory']['alias'] = nh['sys_id']["value"]
-
-        payload['params']['inventory']['location_lat'] = nh['latitude']["value"]
-        payload['params']['inventory']['location_lon'] = nh['longitude']["value"]
-
-
-        # Determine which proxy to use by domain name (just hard code proxy id)
-        # if 'sn.vcloud.kz' in nh["fqdn"] or 'sn.vcloud.kz' in nh["name"]:
-        if nh['x_itgra_monitoring_zabbix_proxy']["value"]: payload['params']['proxy_hostid'] = nh['x_itgra_monitoring_zabbix_proxy']["value"]
-
-        payload['params']['groups'][0]['groupid'] = groupids[nh['sys_class_name']["display_value"]]
-        payload['params']['groups'].append(dict(groupid=export_group))
-        payload['params']['interfaces'][0]['ip'] = nh['ip_address']["value"]
-        payload["params"]["interfaces"][0]["dns"] = nh["fqdn"]["value"]
-        
-        if nh["sys_class_name"]["display_value"] == "Linux Server" or nh["sys_class_name"]["display_value"] == "Windows Server":
-            payload["params"]["interfaces"][0]["type"] = 1
-        else:
-            payload["params"]["interfaces"][0]["type"] = 2
+def get_cached_token(server, user, password, cache_file=TOKEN_CACHE, expired_token=None, validate=True):
+    """Auth token reused between runs, from a 0600 file shared by processes and threads.
+
+    A new user.login only happens when there is no cached token, it fails
+    check_token, or the caller reports it as expired_token after the API
+    answered with is_session_expired(). Comparing against expired_token
+    lets concurrent callers log in once instead of once each.
+
+    The cache lives in a private (0700, ours) directory; when it isn't one,
+    the token is not cached at all rather than shared with other users.
+    """
+    key = '{}@{}'.format(user, server)
+    try:
+        cache_toolkit.private_dir(os.path.dirname(os.path.abspath(cache_file)))
+    except OSError as e:
+        print("{} [get_cached_token] token cache disabled: {}".format(datetime.now(), e))
+        return get_token(server, user, password)
+
+    with token_lock, open(cache_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            cache = cache_toolkit.read_json(cache_file) or {}
+            token = cache.get(key)
+            if token and token != expired_token and (not validate or check_token(server, token)):
+                return token
+
+            token = get_token(server, user, password)
+            cache[key] = token
+            cache_toolkit.write_json(cache_file, cache, mode=0o600)
+            return token
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class ZabbixSession(object):
+    """Minimal JSON-RPC client on a cached token: session.template.get(output=[...])
+
+    Logs in again (once) when the API reports the session as expired.
+    """
+    def __init__(self, server, user, password, cache_file=TOKEN_CACHE):
+        super(ZabbixSession, self).__init__()
+        self.server     = server
+        self.user       = user
+        self.password   = password
+        self.cache_file = cache_file
+        self.url        = api_url(server)
+        self.auth       = get_cached_token(server, user, password, cache_file=cache_file)
+
+    def do_request(self, method, params=None):
+        for attempt in (1, 2):
+            payload = dict(jsonrpc='2.0', method=method, params=params or {}, auth=self.auth, id=1)
+            response = http_toolkit.post(url=self.url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload)).json()
+            if attempt == 1 and is_session_expired(response):
+                self.auth = get_cached_token(self.server, self.user, self.password, cache_file=self.cache_file, expired_token=self.auth)
+                continue
+            if 'error' in response:
+                raise ValueError('Error from {}: {}'.format(method, response['error']))
+            return response
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return ZabbixObject(self, name)
+
+
+class ZabbixObject(object):
+    def __init__(self, session, name):
+        self.session = session
+        self.name    = name
+
+    def __getattr__(self, method):
+        return lambda **params: self.session.do_request('{}.{}'.format(self.name, method), params)['result']
 
 
-        if debug_toolkit.DRYRUN: 
-            dry_request(url=url, headers=HEADERS, payload=payload)
-        else:
-            response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+def get_session_api(server, user, password):
+    return ZabbixSession(server, user, password)
+
+
+def post_batch(url, token, method, params_list, DRYRUN=False):
+    """Send one JSON-RPC batch array (one call per params), return {index: response}
+
+    Every object is its own call, so one bad object doesn't fail the rest
+    of the chunk the way an array in params (a single transaction) would.
+    """
+    payload = [dict(jsonrpc='2.0', method=method, params=params, auth=token, id=index) for index, params in enumerate(params_list)]
 
-            if 'error' in response.json():
-                print('\nError while creating host "%s"\n' % nh['name'], response.json())
+    if debug_toolkit.DRYRUN or DRYRUN:
+        dry_request(url=url, headers=HEADERS, payload=payload)
+        return {}
+
+    response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
+    results = response.json()
+    if not isinstance(results, list):
+        # whole batch rejected (e.g. auth error): report it for every call
+        return {index: results for index in range(len(params_list))}
+    return {result.get('id'): result for result in results}
+
+
+def chunks(items, chunk_size):
+    items = list(items)
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+@deflogger
+def create_hostgroups(new_groups, token, server, chunk_size=CHUNK_SIZE, snapshot=None):
+    """Returns {group name: error} for the groups that could not be created
+
+    With a snapshot_toolkit.HostSnapshot, the created groups are added to it.
+    """
+    url = api_url(server)
+    errors = {}
+
+    for chunk in chunks(new_groups, chunk_size):
+        created = []
+        results = post_batch(url, token, 'hostgroup.create', [dict(name=group) for group in chunk])
+        for index, result in results.items():
+            group = chunk[index]
+            if "error" in result:
+                print("Error while creating group ", group)
+                errors[group] = result["error"]
             else:
-                print('Создан новый узел %s' % payload["params"]["name"])
+                print("The group", group, "has been created.")
+                created.append({'groupid': result['result']['groupids'][0], 'name': group})
+
+        if snapshot is not None and created:
+            snapshot.set_groups(created)
+    return errors
+
+
+def host_create_params(nh, groupids, export_group):
+    params = dict(name=nh["name"]["value"],
+                  host=nh["name"]["value"] + "_" + nh["sys_id"]["value"],
+                  templates=[{'templateid': number} for number in nh['x_itgra_monitoring_zabbix_template']["value"]],
+                  groups=[dict(groupid=groupids[nh['sys_class_name']["display_value"]]),
+                          dict(groupid=export_group)],
+                  inventory_mode=0,
+                  interfaces=[dict(type=None,
+                                   main=1,
+                                   useip=1,
+                                   ip=nh['ip_address']["value"],
+                                   dns=nh["fqdn"]["value"],
+                                   port='161')],
+                  inventory=dict(alias=nh['sys_id']["value"],
+                                 location_lat=nh['latitude']["value"],
+                                 location_lon=nh['longitude']["value"]))
+
+    # Determine which proxy to use by domain name (just hard code proxy id)
+    # if 'sn.vcloud.kz' in nh["fqdn"] or 'sn.vcloud.kz' in nh["name"]:
+    if nh['x_itgra_monitoring_zabbix_proxy']["value"]: params['proxy_hostid'] = nh['x_itgra_monitoring_zabbix_proxy']["value"]
+
+    if nh["sys_class_name"]["display_value"] == "Linux Server" or nh["sys_class_name"]["display_value"] == "Windows Server":
+        params["interfaces"][0]["type"] = 1
+    else:
+        params["interfaces"][0]["type"] = 2
+    return params
+
+
+@deflogger
+def create_hosts(token, server, new_hosts, groupids, export_group, chunk_size=CHUNK_SIZE, snapshot=None):
+    """Create hosts chunk_size at a time, returns {sys_id: error} for the failed ones
+
+    With a snapshot_toolkit.HostSnapshot, the created hosts are read back
+    (one host.get per chunk) and added to it.
+    """
+    url = api_url(server)    
+    errors = {}
+
+    for chunk in chunks(new_hosts, chunk_size):
+        created = []
+        results = post_batch(url, token, 'host.create', [host_create_params(nh, groupids, export_group) for nh in chunk])
+        for index, result in results.items():
+            nh = chunk[index]
+            if 'error' in result:
+                print('\nError while creating host "%s"\n' % nh['name']["value"], result)
+                errors[nh['sys_id']["value"]] = result['error']
+            else:
+                print('Создан новый узел %s' % nh["name"]["value"])
+                created.extend(result['result']['hostids'])
+
+        if snapshot is not None and created:
+            snapshot.upsert(get_hosts_by_hostids(token, server, created))
             
     print('\nПроцедура синхронизации новых хостов завершена\n')
+    return errors
 
 @deflogger
 def get_hostgroups_by_name(token, host, name, DRYRUN=False):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % host
+    url = api_url(host)
     payload = dict(jsonrpc='2.0',
                          method='hostgroup.get',
                          params=dict(output=['groupid', 'name'],
@@ -140,7 +282,7 @@ def get_hostgroups_by_name(token, host, name, DRYRUN=False):
     if debug_toolkit.DRYRUN and DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
         if 'result' in response.json().keys():
             return response.json()['result']
         else:
@@ -149,7 +291,7 @@ def get_hostgroups_by_name(token, host, name, DRYRUN=False):
 
 @deflogger
 def get_hostgroups(token, host, DRYRUN=False):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % host
+    url = api_url(host)
     payload = dict(jsonrpc='2.0',
                          method='hostgroup.get',
                          params=dict(output=['groupid', 'name']),
@@ -158,69 +300,93 @@ def get_hostgroups(token, host, DRYRUN=False):
     if debug_toolkit.DRYRUN and DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
         if 'result' in response.json().keys():
             return response.json()['result']
         else:
             print('Error! Incorrect response from get_servicenow_groups_from_zabbix.')
             exit()
 
-@deflogger
-def get_hosts_by_groupids(token, host, ids, DRYRUN=False):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % host
-    payload = dict(jsonrpc='2.0',
-                        method='host.get',
-                        params=dict(output=['name', 'host'],
-                                    selectInventory=["alias","location","location_lon","location_lat"],
-                                    selectGroups=["groupid", "name"],
-                                    selectParentTemplates=["templateid"],
-                                    selectInterfaces=["ip", "interfaceid", "dns", "type"],
-                                    groupids=ids),
-                        id=1,
-                        auth=token)
+def host_get(token, url, params, caller):
+    """One host.get call, the result parsed once; exits like the other getters on an error reply"""
+    payload = dict(jsonrpc='2.0', method='host.get', params=params, id=1, auth=token)
+    response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
+    body = response.json()
+    if 'result' in body:
+        return body['result']
+    print('Error! Incorrect response from {}.'.format(caller))
+    exit()
 
 
+def host_select(inventory=INVENTORY_FIELDS):
+    return dict(output=['name', 'host'],
+                selectInventory=inventory,
+                selectGroups=["groupid", "name"],
+                selectParentTemplates=["templateid"],
+                selectInterfaces=["ip", "interfaceid", "dns", "type"])
 
-    if debug_toolkit.DRYRUN and DRYRUN: 
-        dry_request(url=url, headers=HEADERS, payload=payload)
-    else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
 
-        if 'result' in response.json().keys():
-            return response.json()['result']
-        else:
-            print('Error! Incorrect response from get_hosts_by_ids.')
-            exit()
+def get_hostids(token, host, groupids=None):
+    """All hostids (of groupids), ids only: a few bytes per host"""
+    params = dict(output=['hostid'], sortfield='hostid')
+    if groupids is not None:
+        params['groupids'] = groupids
+    return [h['hostid'] for h in host_get(token, api_url(host), params, 'get_hostids')]
+
+
+def iter_hosts(token, host, groupids=None, inventory=INVENTORY_FIELDS, chunk_size=HOST_CHUNK_SIZE, workers=WORKERS, DRYRUN=False):
+    """Stream hosts (of groupids) with their inventory, groups, templates and interfaces.
+
+    The hostids are read first, then host.get runs by chunks of chunk_size
+    hostids, up to `workers` chunks concurrently, so neither Zabbix nor we
+    ever hold the whole host list in one response. Hosts are yielded in
+    hostid order.
+    """
+    url = api_url(host)
+    if debug_toolkit.DRYRUN and DRYRUN:
+        dry_request(url=url, headers=HEADERS, payload=dict(jsonrpc='2.0', method='host.get', params=dict(host_select(inventory), groupids=groupids), id=1, auth=token))
+        return
+
+    def get_chunk(hostids):
+        return host_get(token, url, dict(host_select(inventory), hostids=hostids), 'iter_hosts')
+
+    for hosts in http_toolkit.map_ordered(get_chunk, chunks(get_hostids(token, host, groupids), chunk_size), workers):
+        yield from hosts
+
 @deflogger
-def get_hosts(token, host, DRYRUN=False):
-    url = 'https://%s/zabbix/api_jsonrpc.php' % host
-    payload = dict(jsonrpc='2.0',
-                        method='host.get',
-                        params=dict(output=['name', 'host'],
-                                    selectInventory=["alias"],
-                                    selectGroups=["groupid", "name"],
-                                    selectParentTemplates=["templateid"],
-                                    selectInterfaces=["ip", "interfaceid", "dns", "type"]
-                                    ),
-                        id=1,
-                        auth=token)
+def get_hosts_by_groupids(token, host, ids, DRYRUN=False):
+    return list(iter_hosts(token, host, groupids=ids, DRYRUN=DRYRUN))
 
+@deflogger
+def get_hosts_by_hostids(token, host, hostids, DRYRUN=False):
+    url = api_url(host)
+    params = dict(host_select(), hostids=hostids)
 
     if debug_toolkit.DRYRUN and DRYRUN: 
-        dry_request(url=url, headers=HEADERS, payload=payload)
+        dry_request(url=url, headers=HEADERS, payload=dict(jsonrpc='2.0', method='host.get', params=params, id=1, auth=token))
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        return host_get(token, url, params, 'get_hosts_by_hostids')
 
-        if 'result' in response.json().keys():
-            return response.json()['result']
-        else:
-            print('Error! Incorrect response from get_hosts_by_ids.')
-            exit()
+
+@deflogger
+def snapshot_hosts(token, host, groupids, snapshot, max_age=None):
+    """sys_id -> host index read from a snapshot_toolkit.HostSnapshot.
+
+    The full host.get (get_hosts_by_groupids) only runs when the snapshot
+    is older than max_age; otherwise it is served locally.
+    """
+    if max_age is None or snapshot.is_stale(max_age):
+        snapshot.refresh(iter_hosts(token, host, groupids), get_hostgroups(token, host))
+    return snapshot.index()
+
+@deflogger
+def get_hosts(token, host, DRYRUN=False):
+    return list(iter_hosts(token, host, inventory=["alias"], DRYRUN=DRYRUN))
 
 @deflogger
 def get_items(token, host, item_type, output="extend", DRYRUN=False):
     """ex-get-templates & get-proxies"""
-    url = 'https://%s/zabbix/api_jsonrpc.php' % host
+    url = api_url(host)
     params = {
                     "output": output #,
                     #"selectInterface": "extend"
@@ -243,7 +409,7 @@ def get_items(token, host, item_type, output="extend", DRYRUN=False):
     if debug_toolkit.DRYRUN and DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if 'result' in response.json().keys():
             return response.json()['result']
@@ -251,6 +417,20 @@ def get_items(token, host, item_type, output="extend", DRYRUN=False):
             print('Error! Incorrect response from get_items.\n' + response.json()['result'])
             exit()
 
+def objects_version(token, host, item_type, id_field):
+    """[count, highest id] of <item_type>.get: the change check of the reference data cache.
+
+    The count alone misses an object deleted and created again (same
+    count, new id). Only the ids are read, and the highest is found here
+    since the sortfield names differ between object types and versions.
+    """
+    payload = dict(jsonrpc='2.0', method=item_type + '.get', params=dict(output=[id_field]), auth=token, id=1)
+    response = http_toolkit.post(url=api_url(host), headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
+    objects = response.json().get('result')
+    if objects is None:
+        return None
+    return [len(objects), max((int(obj[id_field]) for obj in objects), default=0)]
+
 @deflogger
 def get_templates_api(session, DRYRUN=False):
     templates = session.template.get(output=["host", "templateid"])
@@ -274,15 +454,17 @@ def update_host_name(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if "error" in response.json():
             print("Error while updating host or name; host ID:", host_id)
+            return False
         else:
             if "host" in host.keys():
                 print("Host ID:", host_id, "new host value:", host["host"])
             if "name" in host.keys():
                 print("Host ID:", host_id, "new name value:", host["name"])
+    return True
 
 @deflogger
 def update_host_templates(token, url, host, host_id):
@@ -297,14 +479,16 @@ def update_host_templates(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if "error" in response.json():
             print("Error while updating templates; host_ID:", host_id)
             print(str(response.json()))
             print(host["templates"])
+            return False
         else:
             print("Host ID:", host_id, "new templates:", host["templates"])
+    return True
 
 @deflogger
 def update_hostinterface_ip_dns(token, url, host, host_id):
@@ -323,15 +507,17 @@ def update_hostinterface_ip_dns(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if "error" in response.json():
             print("Error while updating ip or dns; host ID:", host_id)
+            return False
         else:
             if "ip_address" in host.keys():
                 print("Host ID:", host_id, "new IP-address:", host["ip_address"])
             if "dns" in host.keys():
                 print("Host ID:", host_id, "new dns:", host["dns"])
+    return True
 
 @deflogger
 def update_hostinterface_type(token, url, host, host_id):
@@ -346,11 +532,13 @@ def update_hostinterface_type(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
         if "error" in response.json():
             print("Error while updating interface_type; host ID:", host_id)
+            return False
         else:
             print("Host ID:", host_id, "new interface_type:", host["interface_type"])
+    return True
 
 @deflogger
 def update_host_groups(token, url, host, host_id):
@@ -365,11 +553,13 @@ def update_host_groups(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
         if "error" in response.json():
             print("Error while updating groups; host ID:", host_id)
+            return False
         else:
             print("Host ID:", host_id, "new groups:", host["groups"])
+    return True
 
 
 @deflogger
@@ -388,27 +578,185 @@ def update_host_inventory(token, url, host, host_id):
     if debug_toolkit.DRYRUN: 
         dry_request(url=url, headers=HEADERS, payload=payload)
     else:
-        response = requests.post (url=url, headers=HEADERS, data=json.dumps(payload), verify=False)
+        response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
 
         if "error" in response.json():
             print("Error while updating host or name; host ID:", host_id)
+            return False
         else:
             if "location" in host.keys():
                 print("Host ID:", host_id, "new host location:", host["location"])
+    return True
+
+
+# (update function, keys of a data_for_updating entry it applies), in the order they run for one host
+HOST_UPDATES = [
+    (update_host_name,              ("host", "name")),
+    (update_host_templates,         ("templates",)),
+    (update_hostinterface_ip_dns,   ("ip_address", "dns")),
+    (update_hostinterface_type,     ("interface_type",)),
+    (update_host_groups,            ("groups",)),
+    (update_host_inventory,         ("location",)),
+]
+
+
+def apply_host_updates_for_host(token, url, host, host_id):
+    """Run the updates one host needs in order, return the names of the failed ones"""
+    failed = []
+    for update, keys in HOST_UPDATES:
+        if not any(key in host for key in keys):
+            continue
+        try:
+            ok = update(token, url, host, host_id)
+        except http_toolkit.RequestException as e:
+            print("Error while calling {}; host ID: {} ({})".format(update.__name__, host_id, e))
+            ok = False
+        if not ok:
+            failed.append(update.__name__)
+    return failed
+
+
+def plan_host_updates(data_for_updating):
+    """Merge the changes of each host into at most one host.update and one hostinterface.update
+
+    Returns {hostid: [(method, params), ...]}.
+    """
+    plan = {}
+    for host_id, host in data_for_updating.items():
+        calls = []
+
+        params = dict(hostid=host_id)
+        if "host" in host: params["host"] = host["host"]
+        if host.get("name"): params["name"] = host["name"]
+        if "templates" in host: params["templates"] = host["templates"]
+        if "groups" in host: params["groups"] = host["groups"]
+        if "location" in host:
+            params["inventory"] = dict(location=host["location"],
+                                       location_lon=host["longitude"],
+                                       location_lat=host["latitude"])
+        if len(params) > 1: calls.append(('host.update', params))
+
+        if "interface_id" in host:
+            params = dict(interfaceid=host["interface_id"])
+            if "ip_address" in host: params["ip"] = host["ip_address"]
+            if "dns" in host: params["dns"] = host["dns"]
+            if "interface_type" in host: params["type"] = host["interface_type"]
+            if len(params) > 1: calls.append(('hostinterface.update', params))
+
+        if calls: plan[host_id] = calls
+    return plan
+
+
+def unmerged_call_count(data_for_updating):
+    """How many calls the update_host_* functions would make for the same data"""
+    return sum(1 for host in data_for_updating.values() for update, keys in HOST_UPDATES if any(key in host for key in keys))
+
+
+def print_update_plan(plan, data_for_updating):
+    for host_id, calls in plan.items():
+        for method, params in calls:
+            print("[plan] host ID: {} {} {}".format(host_id, method, json.dumps(params)))
+    print("[plan] {} hosts, {} calls ({} without merging)".format(
+        len(plan), sum(len(calls) for calls in plan.values()), unmerged_call_count(data_for_updating)))
+
+
+def apply_planned_calls(token, url, calls, host_id):
+    """Run the planned calls of one host in order, return the failed methods"""
+    failed = []
+    for method, params in calls:
+        payload = dict(jsonrpc='2.0', method=method, params=params, id=1, auth=token)
+        try:
+            response = http_toolkit.post(url=url, headers=HEADERS, data=json.dumps(payload), metric=api_metric(payload))
+            if "error" in response.json():
+                print("Error while calling {}; host ID: {}".format(method, host_id), response.json()["error"])
+                failed.append(method)
+            else:
+                print("Host ID:", host_id, method, params)
+        except http_toolkit.RequestException as e:
+            print("Error while calling {}; host ID: {} ({})".format(method, host_id, e))
+            failed.append(method)
+    return failed
 
 
-def send_trapper_data(sender_param, sender_items):
+@deflogger
+def apply_host_updates(token, url, data_for_updating, workers=WORKERS, merge=True, snapshot=None):
+    """Apply sort_info.sort_zbx_hosts_for_updating output with bounded concurrency.
+
+    Hosts are updated in parallel; the calls for a single host stay
+    sequential, since interface and host updates may touch the same object.
+    With merge, each host gets the calls from plan_host_updates instead of
+    one call per update_host_* function. Successful updates are applied to
+    snapshot (snapshot_toolkit.HostSnapshot) when given, except in dry-run.
+    Returns {'succeeded': [hostid, ...], 'failed': {hostid: [update, ...]}}.
+    """
+    summary = {'succeeded': [], 'failed': {}}
+    if merge:
+        plan = plan_host_updates(data_for_updating)
+        if debug_toolkit.DRYRUN:
+            print_update_plan(plan, data_for_updating)
+            return summary
+        tasks = [(apply_planned_calls, calls, host_id) for host_id, calls in plan.items()]
+    else:
+        tasks = [(apply_host_updates_for_host, host, host_id) for host_id, host in data_for_updating.items()]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(task, token, url, data, host_id): host_id for task, data, host_id in tasks}
+        for future in as_completed(futures):
+            host_id = futures[future]
+            failed = future.result()
+            if failed:
+                summary['failed'][host_id] = failed
+            else:
+                summary['succeeded'].append(host_id)
+                # dry-run update_host_* only print the request: nothing to follow
+                if snapshot is not None and not debug_toolkit.DRYRUN: snapshot.apply_update(host_id, data_for_updating[host_id])
+
+    print("Hosts updated: {}, failed: {}".format(len(summary['succeeded']), len(summary['failed'])))
+    return summary
+
+
+def sender_line(host, key, value):
+    """One line of zabbix_sender input (-i): <host> <key> <value>"""
+    quote = lambda field: '"{}"'.format(str(field).replace('\\', '\\\\').replace('"', '\\"'))
+    return " ".join([quote(host), quote(key), quote(value)])
+
+
+def send_trapper_data(sender_param, sender_items, sender=None):
+    """Send zabbix_sender -i style lines over the trapper protocol.
+
+    sender_param keeps the zabbix_sender command line format (-c/-z/-p/-s are
+    honoured); pass a sender_toolkit.ZabbixSender to reuse its connection.
+    Returns a SenderResult with the processed/failed/total counters, or False.
+    """
     # sender_items = "\n".join( ["- {} {}".format(key, str(sender_dict[key])) for key in sender_dict]) + '\n'
     # sender_param = 'zabbix_sender -c /etc/zabbix/zabbix_agentd.conf -i -'.split(" ")
 
     if not debug_toolkit.DRYRUN:
         try:
-            proc  = Popen(args=sender_param, stdin=PIPE, stdout=PIPE, stderr=PIPE)  
-            sender_stdout = proc.communicate(input=bytearray(sender_items,'utf-8'))[0]
-            return True
-        except:
-            #logger.warn ("[send_trapper_data] Error calling zabbix_sender.")
+            server, port, default_host = sender_toolkit.parse_sender_param(sender_param)
+            values = sender_toolkit.parse_sender_items(sender_items, default_host)
+            if sender:
+                return sender.send(values)
+            with sender_toolkit.ZabbixSender(server=server, port=port) as sender:
+                return sender.send(values)
+        except (sender_toolkit.SenderError, OSError, ValueError) as e:
+            print("{} [send_trapper_data] Error sending data to zbx: {}".format(datetime.now(), e))
             return False
     else:
         if debug_toolkit.DEBUG: 
             print ("{} [send_trapper_data] Would send data to zbx:\n{}".format(datetime.now(), sender_items))
+
+
+def send_metrics(sender_param, host, prefix='sync'):
+    """Push debug_toolkit.metrics as trapper items (plus LLD of the metric names)"""
+    series = debug_toolkit.metrics.snapshot()
+    data = [{'{#METRIC}': name} for name in sorted(series)]
+    lines = [sender_line(host, prefix + '.metric.discovery', json.dumps({'data': data}))]
+    for name, values in sorted(series.items()):
+        key = prefix + '.metric["' + name.replace('"', '\\"') + '",{}]'
+        for field in ('count', 'errors', 'seconds', 'max', 'sent', 'received'):
+            lines.append(sender_line(host, key.format(field), values[field]))
+        avg = values['seconds'] / values['count'] if values['count'] else 0
+        lines.append(sender_line(host, key.format('avg'), avg))
+    lines.append(sender_line(host, prefix + '.run.duration', debug_toolkit.get_uptime()))
+    return send_trapper_data(sender_param, "\n".join(lines) + "\n")
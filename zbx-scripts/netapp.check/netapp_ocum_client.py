@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""External check client of netapp_ocum_query.py --daemon.
+
+Forwards --query/--params/--discovery over the daemon's Unix socket and
+prints the reply, same output as netapp_ocum_query.py would give.
+"""
+
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(sys.path[0], 'lib'))
+import socket_toolkit
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=socket_toolkit.SOCKET_PATH, help="Daemon Unix socket")
+    parser.add_argument("--timeout", type=float, default=socket_toolkit.TIMEOUT, help="Reply timeout, seconds")
+    parser.add_argument("--query", help="Query type: <aggregate|volume|etc>, comma separated for batch mode")
+    parser.add_argument("--discovery", action="store_true", help="Output in Zabbix Discovery format")
+    parser.add_argument("--params", help="Query params (json), optionally keyed by query type in batch mode")
+
+    args = parser.parse_args()
+
+    message = {'query': args.query, 'params': args.params, 'discovery': args.discovery}
+    try:
+        # the default socket must be served by our own user
+        peer = os.getuid() if args.socket == socket_toolkit.SOCKET_PATH else None
+        reply = socket_toolkit.request(args.socket, message, timeout=args.timeout, peer=peer)
+    except socket_toolkit.SocketError as e:
+        print("netapp_ocum_query daemon unavailable: {}".format(e), file=sys.stderr)
+        exit(1)
+    if not reply:
+        print("netapp_ocum_query daemon: empty reply", file=sys.stderr)
+        exit(1)
+    sys.stdout.buffer.write(reply)
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,259 @@
 #!/usr/bin/env python3
 
-import requests
 import sys
 import argparse
 import os
 import json
-import logging
+import threading
+from time import time
+from urllib.parse import urljoin
+from itertools import chain
 
 sys.path.append(os.path.join(sys.path[0], 'lib'))
 import debug_toolkit
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+import cache_toolkit
+import http_toolkit
+import lld_toolkit
+
+API_URI = 'https://{}/rest/'
+MAX_WORKERS = 4
+SERVER_TIMEOUT = 30
+DAEMON_REFRESH = 60
+COLLECT_TYPES = ['aggregate', 'svm', 'volume']
+SENDER_PARAM = 'zabbix_sender -c /etc/zabbix/zabbix_agentd.conf -i -'
+
+class OCUMError(Exception):
+    pass
+
+
+def log(level, message):
+    # logging is only imported when there is something to report
+    import logging
+    getattr(logging, level)(message)
+
+
+def parse_params(text):
+    """--params json, None when absent or invalid"""
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        log('warning', "params invalid: {}".format(text))
+
+
+def discovery_item(item_type, item):
+    """Map an inventory record to Zabbix LLD macros"""
+    discovery_item = {}
+
+    if item_type == "aggregate":
+        discovery_item = {
+            '{#AGGR_NAME}'   : item[item_type]['label'],
+            '{#AGGR_ID}'     : item[item_type]['id'],
+            '{#NODE_NAME}'   : item['node']['label'],
+            '{#NODE_ID}'     : item['node']['id']
+            }
+
+    if item_type == "svm":
+        discovery_item = {
+            '{#SVM_NAME}'   : item[item_type]['label'],
+            '{#SVM_ID}'     : item[item_type]['id']
+            }
+
+    if item_type == "volume":
+        discovery_item = {
+            '{#VOL_NAME}'   : item[item_type]['label'],
+            '{#VOL_ID}'     : item[item_type]['id']
+            }
+
+    discovery_item.update({
+            '{#CLUS_NAME}'   : item['cluster']['label'],
+            '{#CLUS_ID}'     : item['cluster']['id'],
+            '{#STATUS}'      : item['status']
+    })
+    return discovery_item
+
+
+def flatten_record(record, prefix=''):
+    """Yield (field, value) for the scalar status/capacity fields of a record.
+
+    Nested objects are walked with dotted names; references to other
+    objects ({id, label, _links}), lists and HAL fields are skipped.
+    """
+    for field, value in record.items():
+        if field.startswith('_') or isinstance(value, list):
+            continue
+        if isinstance(value, dict):
+            if 'id' in value and 'label' in value:
+                continue
+            yield from flatten_record(value, prefix + field + '.')
+        elif isinstance(value, bool):
+            yield prefix + field, int(value)
+        elif value is not None:
+            yield prefix + field, value
+
+
+def collect(ocum, zbx_host, item_types=COLLECT_TYPES, params=None, sender_param=SENDER_PARAM, workers=MAX_WORKERS, lld_state=None):
+    """Fetch all inventory types in one pass and push LLD and item values via trapper.
+
+    With lld_state (lld_toolkit.DiscoveryState) an LLD payload is only sent
+    when its macro set changed or the state's max age has passed.
+
+    A type that could not be fetched sends nothing at all: an empty LLD
+    would make Zabbix drop every object of that type. Returns (values
+    sent, failed types).
+    """
+    # only the collector talks to the trapper
+    import zbx_toolkit
+    import sender_toolkit
+
+    errors = {}
+    inventory = ocum.batch(item_types=item_types, params=params, workers=workers, errors=errors)
+    lld_lines, item_lines = [], []
+
+    for item_type, records in inventory.items():
+        data = []
+        for record in records:
+            data.append(discovery_item(item_type, record))
+            object_id = record[item_type]['id']
+            for field, value in flatten_record(record):
+                key = 'ocum.{}[{},{}]'.format(item_type, object_id, field)
+                item_lines.append(zbx_toolkit.sender_line(zbx_host, key, value))
+        if lld_state and not lld_state.changed('{}:{}'.format(zbx_host, item_type), data):
+            if debug_toolkit.DEBUG: print("[collect] {} discovery unchanged, not sent".format(item_type))
+            continue
+        lld_lines.append(zbx_toolkit.sender_line(zbx_host, 'ocum.{}.discovery'.format(item_type), json.dumps({'data': data})))
+
+    # LLD goes first so that the prototypes exist when values arrive
+    sender_param = sender_param.split(" ")
+    server, port, _ = sender_toolkit.parse_sender_param(sender_param)
+    with sender_toolkit.ZabbixSender(server=server, port=port) as sender:
+        if lld_lines:
+            lld_result = zbx_toolkit.send_trapper_data(sender_param, "\n".join(lld_lines) + "\n", sender=sender)
+            if lld_state and lld_result and not lld_result.failed:
+                lld_state.commit()
+        result = zbx_toolkit.send_trapper_data(sender_param, "\n".join(item_lines) + "\n", sender=sender)
+    if debug_toolkit.DEBUG: print("[collect] {}".format(result))
+    return len(item_lines), sorted(errors)
+
 
 class OCUM_API(object):
-    """NetApp OCUM API client"""
-    def __init__(self, address, creds):
+    """NetApp OCUM API client.
+
+    With budget (seconds) a whole iter_items() walk is bounded: no retries,
+    every request gets only the time left, and OCUMError once it is spent.
+    """
+    def __init__(self, address, creds, cache=None, timeout=http_toolkit.TIMEOUT, budget=None):
         super(OCUM_API, self).__init__()
         self.address    = address
         self.creds      = creds
-        self.api_uri    = 'https://%s/rest/' % self.address
+        self.cache      = cache
+        self.timeout    = timeout
+        self.budget     = budget
+        self.api_uri    = self.address.rstrip('/') + '/rest/' if '://' in self.address else API_URI.format(self.address)
         self.headers    = {"Accept": "application/vnd.netapp.object.inventory.hal+json"}
 
-    def items(self, item_type, params=None, discovery=None):
+    def iter_items(self, item_type, params=None):
+        """Yield inventory records page by page, following HAL _links.next"""
         resource = item_type + "s"
-        resource_uri = self.api_uri + resource
-        response = requests.get (url=resource_uri, params=params, headers=self.headers, timeout=30, auth=self.creds, verify=False)
-        output = []
-        if response:
-            if '_embedded' in response.json().keys():
-                output = response.json()['_embedded']['netapp:{}InventoryList'.format(item_type)]
+        url = self.api_uri + resource
+        list_key = 'netapp:{}InventoryList'.format(item_type)
 
-            if discovery:
-                data = []
-                
+        deadline = time() + self.budget if self.budget else None
+        while url:
+            if deadline is None:
+                response = http_toolkit.get(url=url, params=params, headers=self.headers, auth=self.creds, timeout=self.timeout)
+            else:
+                left = deadline - time()
+                if left <= 0:
+                    raise OCUMError('{}: no complete {} inventory within {} s'.format(self.address, item_type, self.budget))
+                response = http_toolkit.get(url=url, params=params, headers=self.headers, auth=self.creds,
+                                            timeout=(min(http_toolkit.TIMEOUT[0], left), left), retries=0)
+            if not response:
+                raise OCUMError('Incorrect response ({}):\n{}'.format(response.status_code, response.text))
 
-                for item in output:
-                    discovery_item = []
-                    common_items = {
-                            '{#CLUS_NAME}'   : item['cluster']['label'],
-                            '{#CLUS_ID}'     : item['cluster']['id'],
-                            '{#STATUS}'      : item['status']
-                    }
+            body = response.json()
+            for item in body.get('_embedded', {}).get(list_key, []):
+                yield item
 
-                    if item_type == "aggregate":
-                        discovery_item = {
-                            '{#AGGR_NAME}'   : item[item_type]['label'],
-                            '{#AGGR_ID}'     : item[item_type]['id'],
-                            '{#NODE_NAME}'   : item['node']['label'],
-                            '{#NODE_ID}'     : item['node']['id']
-                            }
+            # next link already carries the query string
+            next_link = body.get('_links', {}).get('next')
+            url = urljoin(url, next_link['href']) if next_link else None
+            params = None
 
-                    if item_type == "svm":
-                        discovery_item = {
-                            '{#SVM_NAME}'   : item[item_type]['label'],
-                            '{#SVM_ID}'     : item[item_type]['id']
-                            }
+    def records(self, item_type, params=None):
+        """Inventory records, served from the shared response cache when one is configured"""
+        if not self.cache:
+            return self.iter_items(item_type, params=params)
+        key = cache_toolkit.cache_key(self.address, item_type, params)
+        return self.cache.get(key, lambda: list(self.iter_items(item_type, params=params)))
 
-                    if item_type == "volume":
-                        discovery_item = {
-                            '{#VOL_NAME}'   : item[item_type]['label'],
-                            '{#VOL_ID}'     : item[item_type]['id']
-                            }
+    def items(self, item_type, params=None, discovery=None):
+        try:
+            if discovery:
+                return {'data': [discovery_item(item_type, item) for item in self.records(item_type, params)]}
+            return list(self.records(item_type, params))
+        except OCUMError as e:
+            log('error', e)
+            return {'data': []} if discovery else []
 
-                    discovery_item.update(common_items)
+    def stream(self, item_type, params=None, discovery=None, fast=False, out=None):
+        """Write the query result to out (stdout) while pages arrive (no full document in memory).
+
+        Returns False when a later page failed: the document written so far
+        is incomplete and the caller has to report an error.
+        """
+        out = out or sys.stdout
+        try:
+            # with a cache, records() already fetches everything: same handling as the first page
+            records = iter(self.records(item_type, params))
+            # the first page decides between a result and the empty document
+            first = [next(records)]
+        except StopIteration:
+            first = []
+        except OCUMError as e:
+            log('error', e)
+            first, records = [], iter(())
+
+        records = chain(first, records)
+        try:
+            if discovery:
+                lld_toolkit.write_discovery((discovery_item(item_type, item) for item in records), out, fast=fast)
+            else:
+                lld_toolkit.write_array(records, out, fast=fast)
+                out.write('\n')
+        except OCUMError as e:
+            log('error', e)
+            out.write('\n')
+            out.flush()
+            return False
+        return True
 
-                    if discovery_item: data.append(discovery_item)
+    def batch(self, item_types, params=None, discovery=None, workers=MAX_WORKERS, errors=None):
+        """Run several queries concurrently over the shared session, keyed by item type.
 
-                output = {'data': data}
+        A failed query is answered empty, as by items(); with an errors dict
+        it is recorded there ({item type: OCUMError}) and left out instead.
+        """
+        def query_params(item_type):
+            # params may be given per query type: {"volume": {...}, "svm": {...}}
+            if params and set(params) <= set(item_types):
+                return params.get(item_type)
+            return params
 
-        else:
-            logging.error('Incorrect response ({}):\n{}'.format(response.status_code, response.text))
+        def run(item_type):
+            if errors is None:
+                return self.items(item_type, query_params(item_type), discovery)
+            try:
+                return list(self.records(item_type, query_params(item_type)))
+            except OCUMError as e:
+                log('error', e)
+                errors[item_type] = e
 
-        return output
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(workers, len(item_types))) as executor:
+            futures = {item_type: executor.submit(run, item_type) for item_type in item_types}
+        return {item_type: future.result() for item_type, future in futures.items() if errors is None or item_type not in errors}
 
     # def volume(self, params=None, discovery=False):
     #     item_type = sys._getframe().f_code.co_name
@@ -79,18 +261,111 @@ class OCUM_API(object):
     #     return items
     
 
+def merge_by_cluster(results):
+    """Merge [(address, records)], keeping each cluster from the first OCUM that reported it"""
+    owners = {}
+    merged = []
+    for address, records in results:
+        for record in records:
+            if owners.setdefault(record['cluster']['id'], address) == address:
+                merged.append(record)
+    return merged
+
+
+class OCUM_Multi(OCUM_API):
+    """Several OCUM servers queried concurrently and seen as one.
+
+    A cluster monitored by more than one OCUM is taken from the first
+    server in the list that returned it. A server that fails or does not
+    answer within `timeout` seconds is left out of the result.
+    """
+    def __init__(self, addresses, creds, cache=None, timeout=SERVER_TIMEOUT):
+        super(OCUM_Multi, self).__init__(','.join(addresses), creds, cache=cache)
+        self.timeout    = timeout
+        self.servers    = [OCUM_API(address, creds, cache=cache, budget=timeout) for address in addresses]
+
+    def records(self, item_type, params=None):
+        results, errors = {}, {}
+
+        def fetch(ocum):
+            try:
+                results[ocum.address] = list(ocum.records(item_type, params))
+            except Exception as e:
+                errors[ocum.address] = e
+
+        # daemon threads: a straggler must not hold the process at exit
+        threads = [threading.Thread(target=fetch, args=(ocum,), daemon=True) for ocum in self.servers]
+        for thread in threads:
+            thread.start()
+        deadline = time() + self.timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time()))
+
+        merged = []
+        for ocum in self.servers:
+            if ocum.address in results:
+                merged.append((ocum.address, results[ocum.address]))
+            elif ocum.address in errors:
+                log('warning', '{}: {} inventory failed, skipped: {}'.format(ocum.address, item_type, errors[ocum.address]))
+            else:
+                log('warning', '{}: no {} inventory within {} s, skipped'.format(ocum.address, item_type, self.timeout))
+        return merge_by_cluster(merged)
+
+
+def query(ocum, queries, params=None, discovery=None, workers=MAX_WORKERS, fast=False, out=None):
+    """Write the result of --query (one type, or a comma separated batch) to out (stdout); False on a truncated result"""
+    out = out or sys.stdout
+    queries = [query.strip() for query in queries.split(',') if query.strip()]
+    if len(queries) > 1:
+        items = ocum.batch(item_types=queries, params=params, discovery=discovery, workers=workers)
+        out.write(json.dumps(items) + '\n')
+    elif queries:
+        return ocum.stream(item_type=queries[0], params=params, discovery=discovery, fast=fast, out=out)
+    return True
+
+
+def serve(ocum, path=None, workers=MAX_WORKERS, fast=False):
+    """Daemon mode: answer netapp_ocum_client.py requests from ocum's in-memory cache"""
+    # socket and signal handling are only needed by the daemon
+    import socket_toolkit
+    path = path or socket_toolkit.SOCKET_PATH
+
+    def handle(message, out):
+        if debug_toolkit.DEBUG: print("[daemon] {}".format(message))
+        query(ocum, message.get('query') or '', parse_params(message.get('params')), message.get('discovery'),
+              workers=workers, fast=fast, out=out)
+
+    try:
+        socket_toolkit.serve(path, handle)
+    except (socket_toolkit.SocketError, OSError) as e:
+        print("Daemon can't start: {}".format(e))
+        exit(1)
+
+
 def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--ocum-addr", help="OCUM server address")
+    parser.add_argument("--ocum-addr", help="OCUM server address (host[:port] or scheme://host[:port]), comma separated for several servers")
+    parser.add_argument("--server-timeout", type=float, default=SERVER_TIMEOUT, help="Per-server timeout with several OCUM servers, seconds")
     parser.add_argument("--ocum-user", help="OCUM account login")
     parser.add_argument("--ocum-pass", help="OCUM account password")
     parser.add_argument("--dry-run", action="store_true", help="dry run mode")
     parser.add_argument("-d", "--debug", action="store_true", help="debug mode")
     parser.add_argument("--trace", action="store_true", help="trace mode")
-    parser.add_argument("--query", help="Query type: <aggregate|volume|etc>")
+    parser.add_argument("--query", help="Query type: <aggregate|volume|etc>, comma separated for batch mode")
     parser.add_argument("--discovery", action="store_true", help="Output in Zabbix Discovery format")
-    parser.add_argument("--params", help="Query params (json)")
+    parser.add_argument("--params", help="Query params (json), optionally keyed by query type in batch mode")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent queries in batch mode")
+    parser.add_argument("--cache-ttl", type=int, default=0, help="Share OCUM responses between runs for N seconds (0 - disabled)")
+    parser.add_argument("--cache-dir", default=cache_toolkit.CACHE_DIR, help="Response cache directory")
+    parser.add_argument("--collect", action="store_true", help="Collector mode: fetch all inventory types and push them via trapper")
+    parser.add_argument("--zbx-host", help="Zabbix host receiving the collected values")
+    parser.add_argument("--sender", default=SENDER_PARAM, help="zabbix_sender command line for collector mode")
+    parser.add_argument("--lld-max-age", type=int, default=0, help="Collector mode: send unchanged discovery only every N seconds (0 - every run)")
+    parser.add_argument("--metrics-textfile", help="Write run metrics to this Prometheus textfile")
+    parser.add_argument("--daemon", action="store_true", help="Daemon mode: keep the inventory in memory and serve netapp_ocum_client.py")
+    parser.add_argument("--socket", help="Daemon mode Unix socket (default: socket_toolkit.SOCKET_PATH)")
+    parser.add_argument("--fast-json", action="store_true", help="Encode output with orjson when installed (compact, not byte-identical)")
 
     args = parser.parse_args()
 
@@ -100,19 +375,43 @@ def main():
     OCUM_ADDR           = args.ocum_addr
     OCUM_CRED           = (args.ocum_user, args.ocum_pass)
 
-    ocum = OCUM_API(OCUM_ADDR, OCUM_CRED)
+    cache = None
+    if args.daemon:
+        # --cache-ttl is the background refresh period here
+        cache = cache_toolkit.MemoryCache(ttl=args.cache_ttl or DAEMON_REFRESH)
+    elif args.cache_ttl > 0:
+        cache = cache_toolkit.FileCache(cache_dir=args.cache_dir, ttl=args.cache_ttl)
+    addresses = OCUM_ADDR.split(',')
+    if len(addresses) > 1:
+        ocum = OCUM_Multi(addresses, OCUM_CRED, cache=cache, timeout=args.server_timeout)
+    else:
+        ocum = OCUM_API(OCUM_ADDR, OCUM_CRED, cache=cache)
     
-    params = None   #{'nodeId': 8}
-    if args.params:
-        try:
-            params = json.loads(args.params)
-        except:
-            logging.warning("params invalid: {}".format(args.params))
-
-    items = ocum.items(item_type=args.query, params=params, discovery=args.discovery)
-    result = json.dumps(items)
-    #result = getattr(ocum, args.query)(params = params, discovery = args.discovery)
-    if result: print(result)
+    params = parse_params(args.params)   #{'nodeId': 8}
+
+    if args.daemon:
+        cache.start()
+        serve(ocum, args.socket, workers=args.workers, fast=args.fast_json)
+        return
+
+    if args.collect:
+        item_types = args.query.split(',') if args.query else COLLECT_TYPES
+        lld_state = None
+        if args.lld_max_age > 0:
+            lld_state = lld_toolkit.DiscoveryState(os.path.join(args.cache_dir, 'lld_fingerprints.json'), max_age=args.lld_max_age)
+        sent, failed = collect(ocum, args.zbx_host, item_types=item_types, params=params, sender_param=args.sender,
+                               workers=args.workers, lld_state=lld_state)
+        print(sent)
+        if args.metrics_textfile: debug_toolkit.write_prometheus_textfile(args.metrics_textfile, prefix='zbx_ocum')
+        if failed:
+            print("Not collected: {}".format(', '.join(failed)))
+            exit(1)
+        return
+
+    complete = query(ocum, args.query, params=params, discovery=args.discovery, workers=args.workers, fast=args.fast_json)
+    if args.metrics_textfile: debug_toolkit.write_prometheus_textfile(args.metrics_textfile, prefix='zbx_ocum')
+    if not complete:
+        exit(1)
 
 if __name__ == "__main__":
     main()